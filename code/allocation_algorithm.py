@@ -19,17 +19,24 @@ except IndexError:
 print(f"opening {file_to_open}, allocation length = {n_top}, batch size = {n_batch}")
 
 # === READING IN BOOSTED FILES ===
-# Read in boosted data from the screening/previous allocation rounds and stack along case/lead time to get one ID
-screening_data = xr.open_dataset(file_to_open).stack(for_sorting=("member","lead_ID")).dropna(dim="for_sorting")
-screening_data_sorted = screening_data.sortby("score",ascending=False).score
+# Read in boosted data from the screening/previous allocation rounds
+screening_data = xr.open_dataset(file_to_open)
 
 # === Run allocation algorithm ===
 # find allocation given screening input
-lead_ID_dict = ac.find_alloc(alloc_type,
-                             screening_data.lead_ID,
-                             screening_data_sorted,
-                             n_top,
-                             n_batch
-                            )
+if alloc_type in ["Static","Weighted"]:
+    # only the top events are needed: the file is read in chunks of lead_IDs, keeping a running top (memory does not grow with the file)
+    top_scores, top_codes, lead_labels = ac.chunked_top(screening_data.score,n_top)
+    lead_ID_dict = ac.find_alloc_top(alloc_type,top_scores,top_codes,lead_labels,n_top,n_batch)
+else:
+    # stack along case/lead time to get one ID, and sort all events
+    screening_data = screening_data.stack(for_sorting=("member","lead_ID")).dropna(dim="for_sorting")
+    screening_data_sorted = screening_data.sortby("score",ascending=False).score
+    lead_ID_dict = ac.find_alloc(alloc_type,
+                                 screening_data.lead_ID,
+                                 screening_data_sorted,
+                                 n_top,
+                                 n_batch
+                                )
 print(lead_ID_dict)
     
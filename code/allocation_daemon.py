@@ -0,0 +1,86 @@
+# imports
+import sys
+sys.path.append("../utils")
+import alloc_service as asv
+import json
+import os
+import time
+
+# === Script explanation ===
+# Long-lived version of allocation_algorithm.py for a live boosting campaign: keeps the top events in memory (see alloc_service.py) and answers requests on stdin, one json object per line, with one json line on stdout.
+# requests:
+#   {"cmd": "ingest_file", "path": ...}                          adds the new (lead_ID, member) events of a .nc file with variable score (lead_ID, member)
+#   {"cmd": "ingest", "lead_ID": [...], "member": [...], "score": [...]}  adds new events directly
+#   {"cmd": "alloc", "n_batch": ..., "alloc_type": ..., "n_top": ...}      allocation of the next round (all optional, default the ones the daemon was started with)
+#   {"cmd": "status"}, {"cmd": "snapshot"}, {"cmd": "quit"}
+# every answer has "ok" (and "error" if not ok). The state is snapshotted after each ingest, and reloaded from the snapshot on restart
+# usage: python allocation_daemon.py [n_top] [n_batch] [alloc_type] [snapshot file] [file to ingest at start]
+# ==========================
+
+# Configurations
+try:
+    n_top = eval(sys.argv[1])
+    n_batch = eval(sys.argv[2])
+    alloc_type = sys.argv[3]
+    snapshot = sys.argv[4]
+except IndexError:
+    n_top = 10
+    n_batch = 10
+    alloc_type = "Weighted"
+    snapshot = "allocation_state.json"
+start_file = sys.argv[5] if len(sys.argv) > 5 else None
+
+def log(message):
+    """logs to stderr, stdout only carries answers"""
+    print(message,file=sys.stderr,flush=True)
+
+def answer(content):
+    """writes one json answer line to stdout"""
+    sys.stdout.write(json.dumps(content) + "\n")
+    sys.stdout.flush()
+
+# === STATE ===
+if os.path.exists(snapshot):
+    state = asv.load_snapshot(snapshot)
+    if state["n_top"] != n_top:
+        log(f"snapshot {snapshot} keeps the top {state['n_top']} events, not {n_top}: using {state['n_top']}")
+    log(f"restarted from {snapshot}: {state['n_events']} events of {len(state['lead_IDs'])} lead_IDs")
+else:
+    state = asv.new_state(n_top,n_batch,alloc_type)
+state["n_batch"] = n_batch
+state["alloc_type"] = alloc_type
+if start_file is not None:
+    log(f"ingested {asv.ingest_file(state,start_file)} new events from {start_file}")
+    asv.save_snapshot(state,snapshot)
+
+# === REQUEST LOOP ===
+log("ready")
+for line in sys.stdin:
+    if line.strip() == "":
+        continue
+    start = time.perf_counter()
+    try:
+        request = json.loads(line)
+        cmd = request.get("cmd")
+        if cmd == "ingest_file":
+            result = {"new": asv.ingest_file(state,request["path"],var=request.get("var","score"))}
+            asv.save_snapshot(state,snapshot)
+        elif cmd == "ingest":
+            result = {"new": asv.ingest(state,request["lead_ID"],request["member"],request["score"])}
+            asv.save_snapshot(state,snapshot)
+        elif cmd == "alloc":
+            result = {"alloc": asv.allocation(state,n_batch=request.get("n_batch"),alloc_type=request.get("alloc_type"),n_top=request.get("n_top"))}
+        elif cmd == "status":
+            result = asv.status(state)
+        elif cmd == "snapshot":
+            asv.save_snapshot(state,snapshot)
+            result = {"path": snapshot}
+        elif cmd == "quit":
+            asv.save_snapshot(state,snapshot)
+            answer({"ok": True})
+            break
+        else:
+            raise ValueError(f"unknown cmd {cmd}")
+        answer(dict(result,ok=True,n_events=state["n_events"],ms=round((time.perf_counter()-start)*1e3,3)))
+    except Exception as err:
+        answer({"ok": False, "error": f"{type(err).__name__}: {err}"})
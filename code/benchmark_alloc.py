@@ -0,0 +1,39 @@
+# imports
+import sys
+sys.path.append("../utils")
+import benchmark as bm
+
+# === Script explanation ===
+# Times the allocation and bootstrap hot paths (find_alloc, lead_ID_sample(_replace), sample_score_alloc, score_algo(_batched) and one score_diff_config grid cell) on synthetic score datasets, see benchmark.py
+# "run" saves the timings as json, "compare" compares a new json to a baseline json and flags benchmarks slower than the tolerance (exit code 1 if any)
+# usage: python benchmark_alloc.py run [output json] [sizes, e.g. small,medium,large]
+#        python benchmark_alloc.py compare [baseline json] [new json] [tolerance]
+# ==========================
+
+# Configurations
+try:
+    mode = sys.argv[1]
+except IndexError:
+    mode = "run"
+params = {"n_top": 10, "n_batch": 50, "n_batch_start": 5, "len_loop": 2, "bootstrap": 20}
+repeat = 5
+skip = [] # names of benchmarks to leave out, e.g. ["score_algo"] (the slow loop engine) on large sizes
+
+if mode == "run":
+    output = sys.argv[2] if len(sys.argv) > 2 else "benchmark.json"
+    sizes = sys.argv[3].split(",") if len(sys.argv) > 3 else ["small","medium"]
+    results = bm.run(sizes=sizes,repeat=repeat,skip=skip,**params)
+    bm.save(results,output)
+    print(f"saved to {output}")
+elif mode == "compare":
+    baseline = bm.load(sys.argv[2])
+    new = bm.load(sys.argv[3])
+    tolerance = eval(sys.argv[4]) if len(sys.argv) > 4 else 0.2
+    rows = bm.compare(baseline,new,tolerance=tolerance)
+    for size, name, ratio, regression in rows:
+        print(f"{size:>8} {name:<32} {ratio:6.2f}x {'REGRESSION' if regression else ''}")
+    n_regressions = sum(regression for *_, regression in rows)
+    print(f"{n_regressions} regression(s) above {tolerance:.0%} out of {len(rows)} benchmarks")
+    sys.exit(1 if n_regressions > 0 else 0)
+else:
+    print("mode should be 'run' or 'compare'")
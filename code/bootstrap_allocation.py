@@ -3,6 +3,7 @@ import sys
 sys.path.append("../utils")
 import bootstrap_alloc as ba
 import xarray as xr
+import os
 
 # Configurations
 try: 
@@ -23,14 +24,24 @@ n_batch = [5,10,20,30,50,75,100,200,300,500]
 n_start_batch = [3,5,10,20,25]
 len_loop = 2
 bootstrap = 500
+n_workers = os.cpu_count() # number of processes the grid cells are spread over
+seed = None # seed of the sweep (the one used is saved in the output attributes)
+encoding = "dense" # how scores are saved: "dense", "ragged" or "summary" (see sweep_store.encode_score_info)
+engine = "batched" # "batched", or "adaptive" to stop each grid cell once its results are precise enough (bootstrap is then the maximum, see bootstrap_alloc.score_algo_adaptive). Only for lead_ID True, the cases are always run batched
+adaptive = None # stopping settings of engine "adaptive", e.g. {"block": 50, "target_se": 0.05}
+timed = False # whether to save the time spent in each phase of each grid cell (see timing.py)
+store_format = "netcdf" # format of the scores made by preprocess_to_event.py: "netcdf" or "zarr"
+common = False # whether the grid cells of each n_start_batch share their screening and member draws (common random numbers, see bootstrap_alloc.score_algo_batched), for lower variance comparisons between n_top and n_batch. Only with engine "batched"
+scheduler = None # None to run the grid cells on n_workers local processes, "local" for a dask LocalCluster of n_workers, or the address of a dask.distributed scheduler to spread them over nodes (e.g. "tcp://node:8786")
 print(f"Bootstrap sweep for {to_open}:n_top ={n_top},n_batch={n_batch},n_start_batch={n_start_batch},len_loop={len_loop},bootstrap={bootstrap}")
 
 # Paths
 in_path = '/net/xenon/climphys/lbloin/optim_boost/'
+client = None if scheduler is None else ba.dask_client(None if scheduler == "local" else scheduler,n_workers=n_workers)
 # === READING IN BOOSTED FILES ===
 print("Reading in boosted data files")
 # Read in boosted data from the screening/previous allocation rounds and stack along case/lead time to get one ID
-ds = xr.open_dataset(f"{in_path}boosted_{to_open}_lead_ID_{lead_ID}_roll{roll}.nc")
+ds = xr.open_dataset(f"{in_path}boosted_{to_open}_lead_ID_{lead_ID}_roll{roll}{'.zarr' if store_format == 'zarr' else '.nc'}")
 if lead_ID == True:
     # for now, lead times -20 to -10 and only members 1 to 100
     ds = ds.sel(member=slice(1,100))
@@ -44,23 +55,35 @@ if lead_ID == True:
                          len_loop, 
                          bootstrap, 
                          to_open,
+                         n_workers=n_workers,
+                         seed=seed,
+                         output_path=in_path,
+                         encoding=encoding,
+                         engine=engine,
+                         adaptive=adaptive,
+                         timed=timed,
+                         client=client,
+                         common=common,
                          )
     
 else:
-    for case in ds.case:
-        print(case.values)
-        ds_case = ds.sel(case=case).rename({"lead_time":"lead_ID"}).dropna("lead_ID",how="all").dropna("member",how="all").drop_vars("case")
-        ds_case["lead_ID"] = [f"{ld}" for ld in ds_case.lead_ID.values]
-        # === Run allocation algorithm for all scores chosen (with bootstrap) ===
-        print("Allocation algorithm")
-        ba.score_diff_config(ds_case.score, 
-                             n_top, 
-                             n_batch,
-                             n_start_batch,
-                             len_loop, 
-                             bootstrap, 
-                             f"{to_open}_{case.values}",
-                             )
-    
-
-
+    # all cases at once, batched over case: each case only draws from its own lead times and members (see bootstrap_alloc.score_algo_batched)
+    ds = ds.rename({"lead_time":"lead_ID"})
+    ds["lead_ID"] = [f"{ld}" for ld in ds.lead_ID.values]
+    # === Run allocation algorithm for all scores chosen (with bootstrap) ===
+    print("Allocation algorithm")
+    ba.score_diff_config(ds.score, 
+                         n_top, 
+                         n_batch,
+                         n_start_batch,
+                         len_loop, 
+                         bootstrap, 
+                         f"{to_open}_cases",
+                         n_workers=n_workers,
+                         seed=seed,
+                         output_path=in_path,
+                         encoding=encoding,
+                         timed=timed,
+                         client=client,
+                         common=common,
+                         )
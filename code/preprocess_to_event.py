@@ -2,6 +2,8 @@
 import sys
 sys.path.append("../utils")
 import utils as ut
+import climatology as cl
+import zarr_store as zs
 import xarray as xr
 import glob
 import pandas as pd
@@ -32,6 +34,8 @@ except IndexError:
     nb_heatw_day = True # score type 1: total number of heatwave days in summer
     temp_max = True # score type 2: maximum temperature around unperturbed peak
     temp_max_anom = True # score_type 3: maximum temperature relative to climatology around unperturbed peak
+store_format = "netcdf" # format of the time series read and of the scores saved: "netcdf" or "zarr" (chunked stores, see zarr_store.py)
+ext = ".zarr" if store_format == "zarr" else ".nc"
 
 print(f"{area}, rolling mean {roll} Scoring number of heatwave days = {nb_heatw_day}, Maximum temperature = {temp_max}, Maximum temperature with anomaly = {temp_max_anom}, with stacking to lead_ID = {with_lead_ID}")
 
@@ -41,32 +45,43 @@ in_path = '/net/xenon/climphys/lbloin/optim_boost/'
 # === READING IN NECESSARY FILES ===
 print("Reading in climatology")
 # Read in climatology data
-clim = xr.open_dataset(in_path + f"TREFHTMX_{area}_2005-2035.nc").TREFHTMX
-mn = clim.groupby("time.dayofyear").mean().rolling(dayofyear=20,center=True).mean().mean("member")
-# read in boosted data
-files = glob.glob(in_path+f"TREFHTMX_{area}_boosted_*.nc")
-cases = [file[-10:-3] for file in files]
+clim_file = in_path + f"TREFHTMX_{area}_2005-2035{ext}"
+clim = xr.open_dataset(clim_file).TREFHTMX
+# statistics of the climatology are computed once and then read from sidecar files (see climatology.py)
+if temp_max_anom == True:
+    mn = cl.dayofyear_mean(clim_file,window=20)
+# read in boosted data: one file per case, or one group per case of the zarr store
+if store_format == "zarr":
+    boost_store = in_path+f"TREFHTMX_{area}_boosted.zarr"
+    cases = zs.groups(boost_store)
+    open_case = lambda case: zs.open_store(boost_store,group=case)
+else:
+    files = glob.glob(in_path+f"TREFHTMX_{area}_boosted_*.nc")
+    cases = [file[-10:-3] for file in files]
+    open_case = lambda case: xr.open_dataset(in_path+f"TREFHTMX_{area}_boosted_{case}.nc")
 
 
 # === Defining one (or several) score(s) ===
 print("Reading in boosting and getting scores")
 to_score = {} # dictionary of types of event scores to save
-# open and process boosted data
+# open and process boosted data: each file is read and transformed once, and kept around peak and/or whole, depending on the scores
+boost_around_peak = {True: [], False: []}
+for case in cases:
+    parent = clim.sel(member=int(case[0:2]),time=case[3:7]).rolling(time=roll, center=True).mean().convert_calendar("proleptic_gregorian")
+    peak = parent.idxmax().values
+    ds = open_case(case).convert_calendar("proleptic_gregorian").rolling(time=roll, center=True).mean()
+    ds["start_date"] = [(pd.to_datetime(ld)-peak).days for ld in ds.start_date.values]
+    ds = ds.rename({"start_date":"lead_time"})
+    # restrict lead_time
+    ds = ds.sel(lead_time=slice(-20,-10))
+    if temp_max == True or temp_max_anom == True:
+        boost_around_peak[True].append(ds.sel(time = slice(peak - pd.Timedelta(days = 5), peak + pd.Timedelta(days = 5))))# keep only values around peak
+    if nb_heatw_day == True:
+        boost_around_peak[False].append(ds)
 for around_peak in [True,False]:
-    boost = []
-    for file in files:
-        case = file[-10:-3]
-        parent = clim.sel(member=int(case[0:2]),time=case[3:7]).rolling(time=roll, center=True).mean().convert_calendar("proleptic_gregorian")
-        peak = parent.idxmax().values
-        ds = xr.open_dataset(file).convert_calendar("proleptic_gregorian").rolling(time=roll, center=True).mean()
-        ds["start_date"] = [(pd.to_datetime(ld)-peak).days for ld in ds.start_date.values]
-        ds = ds.rename({"start_date":"lead_time"})
-        # restrict lead_time
-        ds = ds.sel(lead_time=slice(-20,-10))
-        if around_peak == True:
-            ds = ds.sel(time = slice(peak - pd.Timedelta(days = 5), peak + pd.Timedelta(days = 5)))# keep only values around peak
-        boost.append(ds)
-    boost = xr.concat(boost, dim="case")
+    if boost_around_peak[around_peak] == []:
+        continue
+    boost = xr.concat(boost_around_peak[around_peak], dim="case")
     boost["case"] = cases
     if with_lead_ID == True:
         boost = ut.multi_to_single_index(boost)
@@ -80,11 +95,14 @@ for around_peak in [True,False]:
         if nb_heatw_day == True:
             ds_summer = boost.groupby("time.season")["JJA"].TREFHTMX.compute()
             #finding 90th percentile of summer temperatures (=defined as heatwave)
-            q_90 = clim.groupby("time.season")["JJA"].quantile(0.9).compute()
+            q_90 = cl.season_quantile(clim_file,q=0.9,season="JJA")
             number_of_heatw_days = ds_summer.where(ds_summer >= q_90,drop=True).count(dim='time')
             to_score["heatw_day"] = number_of_heatw_days
 
 print("Saving as netcdf")
 for score in to_score:
     print(f"saving {score}")
-    to_score[score].to_dataset(name="score").to_netcdf(f"{in_path}boosted_{area}_{score}_lead_ID_{with_lead_ID}_roll{roll}.nc")
\ No newline at end of file
+    if store_format == "zarr":
+        zs.write(to_score[score].to_dataset(name="score"),f"{in_path}boosted_{area}_{score}_lead_ID_{with_lead_ID}_roll{roll}.zarr",zs.SCORE_CHUNKS)
+    else:
+        to_score[score].to_dataset(name="score").to_netcdf(f"{in_path}boosted_{area}_{score}_lead_ID_{with_lead_ID}_roll{roll}.nc")
\ No newline at end of file
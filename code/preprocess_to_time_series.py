@@ -2,10 +2,12 @@
 import sys
 sys.path.append("../utils")
 import preproc as pc
+import file_index as fi
 
 # === Script explanation ===
 # If unpert = True, takes all Large Ensemble CESM2 runs (2005-2035) and outputs it as a temperature time series. Either averaged over selected area or outputted globally. 
 # If boost = True, it preprocesses all relevant boosted runs in the same way (boosted runs are location-specific, the relevant runs are provided in input file 
+# All areas are done in a single pass: each file is read once and reduced to every area
 # ==========================
 
 
@@ -25,21 +27,25 @@ except IndexError:
     areas = ["PNW","CH","MID","PAR","global"]
     unpert = True
     boost = True
+store_format = "netcdf" # "netcdf" (one file per area, and per case for boosted runs) or "zarr" (chunked stores that new cases and members are appended to, see zarr_store.py)
 print(areas)
+if boost == True:
+    # one scan of the boosted runs folder, shared by all areas
+    boost_index = fi.boost_index(boost_path,output_path+"boost_file_index.json")
 
 # preprocess
+# deciding if area should be selected through regionmask or just cut out box
+read_types = {}
 for area in areas:
-    print(area)
-    # deciding if area should be selected through regionmask or just cut out box
     if area == "CH":
-        read_type = "regionmask"
+        read_types[area] = "regionmask"
     else:
-        read_type = "box"
-    print(read_type)
-    if unpert == True:
-        print("preprocessing unperturbed runs")
-        pc.preproc_unpert(in_path, output_path,area,read_type)
-    if boost == True:
-        print("preprocessing boosted runs")
-        pc.preproc_boost(boost_path, output_path,area,read_type)
-
+        read_types[area] = "box"
+print(read_types)
+# all areas are preprocessed together, so each file is read only once
+if unpert == True:
+    print("preprocessing unperturbed runs")
+    pc.preproc_unpert_multi(in_path, output_path,read_types,store_format=store_format)
+if boost == True:
+    print("preprocessing boosted runs")
+    pc.preproc_boost_multi(boost_path, output_path,read_types,index=boost_index,store_format=store_format)
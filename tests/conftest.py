@@ -0,0 +1,21 @@
+import os
+import sys
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","utils"))
+import numpy as np
+import xarray as xr
+import pytest
+
+def make_scores(n_leads,n_members,seed=0,integer=False,nan_fraction=0.1):
+    """returns a (lead_ID, member) DataArray of scores like the output of preprocess_to_event, with some missing (NaN) members. integer scores have many ties"""
+    rng = np.random.default_rng(seed)
+    if integer:
+        values = rng.integers(0,6,size=(n_leads,n_members)).astype(float)
+    else:
+        values = rng.gumbel(size=(n_leads,n_members)) + rng.normal(size=(n_leads,1))
+    values[rng.random(values.shape) < nan_fraction] = np.nan
+    return xr.DataArray(values,dims=("lead_ID","member"),coords={"lead_ID": [f"L{i}" for i in range(n_leads)],"member": range(1,n_members+1)},name="score")
+
+@pytest.fixture
+def scores():
+    """small score DataArray (12 lead_IDs, 20 members) with missing members"""
+    return make_scores(12,20)
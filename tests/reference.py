@@ -0,0 +1,69 @@
+import numpy as np
+
+# === Reference allocations ===
+# The loop allocations of alloc.py before the array kernels, kept to check that the faster versions give the same allocations (values and key order)
+# ==========================
+
+def sorted_events(da):
+    """returns the scored events of a (lead_ID, member) DataArray sorted descending, as allocation_algorithm.py builds top_events"""
+    stacked = da.stack(for_sorting=("member","lead_ID")).dropna(dim="for_sorting")
+    return stacked.sortby(stacked,ascending=False)
+
+def find_alloc_static(top_events,n_top,n_batch):
+    """allocates amount of new samples to draw for each lead time, by giving n_batch number of new samples for each event in that lead time that was in the top selection"""
+    rank_list = top_events[0:n_top] #top events
+    occ_per_lead_ID = {} # dict containing amount of new realizations per lead time
+    # need to allocate n_batch/n_top per top event, but can only allocate round numbers. excess will be distributated among the top of the top
+    new_batch = int(n_batch/n_top)
+    diff = n_batch - new_batch*n_top
+    for i,mx in enumerate(rank_list):
+        #distribute excess (if there is any)
+        if diff > 0:
+            allocate_here = new_batch + 1
+            diff -= 1
+        else:
+            allocate_here = new_batch
+        #allocate new realizationa
+        if f"{mx.lead_ID.values}" in occ_per_lead_ID.keys():
+            occ_per_lead_ID[f"{mx.lead_ID.values}"] += allocate_here
+        else:
+            occ_per_lead_ID[f"{mx.lead_ID.values}"] = allocate_here
+    if diff > 0:
+        occ_per_lead_ID[f"{rank_list[0].lead_ID.values}"] += diff
+    return occ_per_lead_ID
+
+def find_alloc_weighted(top_events,n_top,n_batch):
+    """allocates amount of new samples to draw for each lead time, by weighting the top runs by how far they are from the top 1 event"""
+    rank_list = top_events[0:n_top] #top events
+    occ_per_lead_ID = {}
+    if len(rank_list) > 1:
+        total_dist = rank_list[0]-rank_list[-1]
+        if total_dist == 0 : # if all values are the same
+            return find_alloc_static(top_events,n_top,n_batch)
+        relative_dists = np.zeros(n_top)
+        # find the ratio of relative distande/total distance
+        for i,rk in enumerate(rank_list):
+            relative_dists[i] = (rk - rank_list[-1])
+
+        # normalize weights so total new allocated round correspond ~ to n_batch
+        weights = [int(r*(n_batch)/sum(relative_dists)) for r in relative_dists]
+        # add 1 more sample to allocate for each weight until total new allocated round correspond exactly to n_batch
+        diff = n_batch-sum(weights)
+        # allocate to dict of lead times
+        for i, rk in enumerate(rank_list):
+            if diff > 0:
+                allocate_here = weights[i] + 1
+                diff -= 1
+            else:
+                allocate_here = weights[i]
+            if f"{rk.lead_ID.values}" in occ_per_lead_ID.keys():
+                occ_per_lead_ID[f"{rk.lead_ID.values}"] += allocate_here
+            else:
+                occ_per_lead_ID[f"{rk.lead_ID.values}"] = allocate_here
+        if diff > 0:
+            occ_per_lead_ID[f"{rank_list[0].lead_ID.values}"] += diff
+    else:
+        occ_per_lead_ID[f"{rank_list[0].lead_ID.values}"] = n_batch
+    return occ_per_lead_ID
+
+REFERENCE = {"Static": find_alloc_static, "Weighted": find_alloc_weighted}
@@ -0,0 +1,75 @@
+import numpy as np
+import xarray as xr
+import pytest
+import alloc as ac
+import reference as ref
+from conftest import make_scores
+
+CASES = [(seed,n_top,n_batch) for seed in range(4) for n_top, n_batch in [(1,4),(3,7),(5,23),(10,10),(12,5)]]
+
+@pytest.mark.parametrize("integer",[False,True])
+@pytest.mark.parametrize("alloc_type",["Static","Weighted"])
+@pytest.mark.parametrize("seed,n_top,n_batch",CASES)
+def test_find_alloc_matches_reference(seed,n_top,n_batch,alloc_type,integer):
+    """find_alloc (array kernels) gives the allocation of the loop version, with the same key order, also for tied (integer) scores"""
+    top_events = ref.sorted_events(make_scores(15,30,seed=seed,integer=integer))
+    expected = ref.REFERENCE[alloc_type](top_events,n_top,n_batch)
+    result = ac.find_alloc(alloc_type,top_events.lead_ID,top_events,n_top,n_batch)
+    assert list(result.items()) == list(expected.items())
+
+@pytest.mark.parametrize("alloc_type",["Static","Weighted"])
+@pytest.mark.parametrize("n_top,n_batch",[(3,7),(5,23),(10,10)])
+def test_batched_kernels_match_reference(alloc_type,n_top,n_batch):
+    """the batched kernels allocate each replicate like the loop version, including replicates with fewer than n_top events (NaN padded)"""
+    n_leads = 8
+    replicates = [ref.sorted_events(make_scores(n_leads,4,seed=seed,integer=seed % 2 == 1,nan_fraction=0.15*seed)) for seed in range(6)]
+    lead_list = [f"L{i}" for i in range(n_leads)]
+    top_scores = np.full((len(replicates),n_top),np.nan)
+    top_codes = np.zeros((len(replicates),n_top),dtype=int)
+    for i,events in enumerate(replicates):
+        top = events[:n_top]
+        top_scores[i,:len(top)] = top.values
+        top_codes[i,:len(top)] = [lead_list.index(f"{ld}") for ld in top.lead_ID.values]
+    result = ac.find_alloc_batched(alloc_type,top_scores,top_codes,n_top,n_batch,n_leads)
+    for i,events in enumerate(replicates):
+        expected = np.zeros(n_leads,dtype=int)
+        for lead_ID, count in ref.REFERENCE[alloc_type](events,n_top,n_batch).items():
+            expected[lead_list.index(lead_ID)] = count
+        np.testing.assert_array_equal(result[i],expected)
+
+@pytest.mark.parametrize("chunk_size",[1,4,7,None])
+@pytest.mark.parametrize("integer",[False,True])
+@pytest.mark.parametrize("alloc_type",["Static","Weighted"])
+@pytest.mark.parametrize("seed,n_top,n_batch",CASES)
+def test_chunked_top_matches_reference(seed,n_top,n_batch,alloc_type,integer,chunk_size):
+    """the running top of chunked_top, allocated with find_alloc_top, gives the allocation of the sorted stack for any chunk size, ties and key order included"""
+    da = make_scores(15,30,seed=seed,integer=integer)
+    expected = ref.REFERENCE[alloc_type](ref.sorted_events(da),n_top,n_batch)
+    result = ac.find_alloc_top(alloc_type,*ac.chunked_top(da,n_top,chunk_size=chunk_size),n_top,n_batch)
+    assert list(result.items()) == list(expected.items())
+
+def test_chunked_top_of_lazy_file(tmp_path):
+    """chunked_top reads a lazily opened file like the loaded array"""
+    da = make_scores(15,30,integer=True)
+    da.to_dataset().to_netcdf(tmp_path / "scores.nc")
+    with xr.open_dataset(tmp_path / "scores.nc") as ds:
+        top, top_codes, lead_labels = ac.chunked_top(ds.score,10,chunk_size=4)
+    expected = ref.sorted_events(da)[:10]
+    np.testing.assert_array_equal(top,expected.values)
+    np.testing.assert_array_equal(lead_labels[top_codes],expected.lead_ID.values)
+
+def test_random_alloc_draws_events_uniformly():
+    """Random allocation draws lead_IDs in proportion to their number of events, keys in order of first occurrence"""
+    lead_IDs = np.array(["b","a","b","c","b","a"])
+    result = ac.find_random_alloc(60000,lead_IDs,rng=np.random.default_rng(0))
+    assert list(result) == ["b","a","c"]
+    assert sum(result.values()) == 60000
+    np.testing.assert_allclose([result["b"],result["a"],result["c"]],[30000,20000,10000],rtol=0.03)
+
+def test_random_alloc_batched_weights():
+    """the batched Random allocation draws n_batch per replicate in proportion to the weights, nothing from lead codes of weight 0"""
+    weights = np.array([[3,1,0],[0,0,0]])
+    alloc = ac.find_random_alloc_batched(2,1000,3,weights=weights,rng=np.random.default_rng(0))
+    np.testing.assert_array_equal(alloc.sum(axis=-1),[1000,0])
+    assert alloc[0,2] == 0
+    assert 700 < alloc[0,0] < 800
@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+import alloc_service as asv
+import reference as ref
+from conftest import make_scores
+
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","code")
+
+@pytest.fixture
+def batches(tmp_path):
+    """a growing score file of a campaign: the first batch of members, then all members (the first batch again, plus new ones). returns [path of batch 1, path of batch 2, full DataArray]"""
+    da = make_scores(15,30,seed=5,integer=True)
+    paths = []
+    for i,n_members in enumerate([12,30]):
+        path = str(tmp_path / f"batch{i}.nc")
+        da.isel(member=slice(0,n_members)).to_dataset().to_netcdf(path)
+        paths.append(path)
+    return paths + [da]
+
+@pytest.mark.parametrize("alloc_type",["Static","Weighted"])
+def test_two_batches_equal_one_shot(batches,tmp_path,alloc_type):
+    """ingesting a growing file after each batch (through a snapshot) gives the allocation of the whole file at once"""
+    first, second, da = batches
+    state = asv.new_state(10,17,alloc_type)
+    asv.ingest_file(state,first)
+    asv.save_snapshot(state,str(tmp_path / "state.json"))
+    state = asv.load_snapshot(str(tmp_path / "state.json"))
+    n_new = asv.ingest_file(state,second)
+    assert n_new == int(da.isel(member=slice(12,None)).notnull().sum())
+    assert state["n_events"] == int(da.notnull().sum())
+    expected = ref.REFERENCE[alloc_type](ref.sorted_events(da),10,17)
+    assert list(asv.allocation(state).items()) == list(expected.items())
+    # the smaller n_top of a request is taken from the same pool
+    expected = ref.REFERENCE[alloc_type](ref.sorted_events(da),4,9)
+    assert list(asv.allocation(state,n_batch=9,n_top=4).items()) == list(expected.items())
+
+def test_daemon_two_batches(batches,tmp_path):
+    """the allocation daemon answers json requests on stdin, and its allocation after two ingested batches is the one of the whole file"""
+    first, second, da = batches
+    requests = [{"cmd": "ingest_file", "path": first}, {"cmd": "ingest_file", "path": second}, {"cmd": "alloc"}, {"cmd": "alloc", "alloc_type": "Random"}, {"cmd": "quit"}]
+    run = subprocess.run([sys.executable,"allocation_daemon.py","10","17","Weighted",str(tmp_path / "state.json")],cwd=CODE,input="".join(json.dumps(r) + "\n" for r in requests),capture_output=True,text=True,timeout=120)
+    answers = [json.loads(line) for line in run.stdout.splitlines()]
+    assert [answer["ok"] for answer in answers] == [True,True,True,False,True]
+    assert answers[1]["n_events"] == int(da.notnull().sum())
+    assert list(answers[2]["alloc"].items()) == list(ref.find_alloc_weighted(ref.sorted_events(da),10,17).items())
+    assert os.path.exists(tmp_path / "state.json")
@@ -0,0 +1,35 @@
+import xarray as xr
+import pytest
+import analysis as an
+from test_sweep import run_sweep
+
+ENCODINGS = ["dense","ragged","summary"]
+
+@pytest.fixture
+def sweeps(scores,tmp_path):
+    """paths of the same sweep (same seed) saved in each encoding"""
+    paths = {}
+    for encoding in ENCODINGS:
+        run_sweep(scores,tmp_path,save_info=encoding,encoding=encoding,thresholds=[1.])
+        paths[encoding] = f"{tmp_path}/score_info_{encoding}.nc"
+    return paths
+
+@pytest.mark.parametrize("name,params",[("best_score",{}),("exceedance",{"threshold": 1.}),("allocated",{}),("gain",{})])
+def test_metrics_same_for_all_encodings(sweeps,tmp_path,name,params):
+    """every metric gives the same result on the dense, ragged and summary outputs of a sweep"""
+    results = {encoding: an.metric(path,name,cache_dir=f"{tmp_path}/",**params) for encoding, path in sweeps.items()}
+    for encoding in ENCODINGS[1:]:
+        xr.testing.assert_allclose(results[encoding],results["dense"])
+
+def test_metric_cached(sweeps,tmp_path):
+    """a metric is computed once, then read from its sidecar file"""
+    first = an.metric(sweeps["ragged"],"best_score",cache_dir=f"{tmp_path}/")
+    calls = []
+    cached = an.METRICS["best_score"]
+    an.METRICS["best_score"] = lambda ds: calls.append(ds) or cached(ds)
+    try:
+        second = an.metric(sweeps["ragged"],"best_score",cache_dir=f"{tmp_path}/")
+    finally:
+        an.METRICS["best_score"] = cached
+    assert calls == []
+    xr.testing.assert_identical(first,second)
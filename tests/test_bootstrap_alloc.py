@@ -0,0 +1,27 @@
+import numpy as np
+import xarray as xr
+import pytest
+import bootstrap_alloc as ba
+
+@pytest.mark.parametrize("replace",[False,True])
+def test_batched_engine_matches_loop_layout(scores,replace):
+    """the batched engine gives a score_info with the same dimensions, coordinates and screening as score_algo (the padding of distribution_value depends on the draws)"""
+    loop = ba.score_algo(scores,3,5,2,3,4,replace=replace,rng=np.random.default_rng(1))
+    batched = ba.score_algo_batched(scores,3,5,2,3,4,replace=replace,rng=np.random.default_rng(1))
+    assert {dim: size for dim, size in batched.sizes.items() if dim != "distribution_value"} == {dim: size for dim, size in loop.sizes.items() if dim != "distribution_value"}
+    for coord in ["alloc_type","round","lead_ID"]:
+        np.testing.assert_array_equal(batched[coord].values,loop[coord].values)
+    # the screening draws n_batch_start members of every lead_ID
+    xr.testing.assert_equal(batched.chosen_leads.sel(round=0),loop.chosen_leads.sel(round=0))
+
+def test_batched_engine_draws_scores_of_allocated_leads(scores):
+    """each allocation round draws n_batch members, and every score drawn is a score of ds"""
+    n_batch = 5
+    batched = ba.score_algo_batched(scores,3,n_batch,2,3,4,replace=True,rng=np.random.default_rng(1))
+    drawn = batched.chosen_leads.sel(round=slice(1,None)).sum("lead_ID")
+    assert (drawn == n_batch).all()
+    counts = batched.score.sel(round=slice(1,None)).notnull().sum("distribution_value")
+    # members without score (NaN) are drawn but give no score
+    assert (counts <= n_batch).all()
+    drawn_scores = batched.score.values[~np.isnan(batched.score.values)]
+    assert np.isin(drawn_scores,scores.values).all()
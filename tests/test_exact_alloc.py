@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import exact_alloc as ea
+from conftest import make_scores
+
+N_REP = 20000
+
+def simulate(values,counts,replace,rng):
+    """Monte Carlo draws of the rounds of counts (list of counts per lead code): each round draws distinct members of each lead, from all members (replace) or from those not drawn before. returns the (N_REP, n_drawn) drawn scores"""
+    n_leads, n_members = values.shape
+    draws = []
+    for rep in range(N_REP):
+        drawn = []
+        left = [list(rng.permutation(n_members)) for lead in range(n_leads)]
+        for round_counts in counts:
+            for lead, k in enumerate(round_counts):
+                if replace:
+                    drawn += list(values[lead,rng.permutation(n_members)[:k]])
+                else:
+                    drawn += list(values[lead,left[lead][:k]])
+                    left[lead] = left[lead][k:]
+        draws.append(drawn)
+    return np.array(draws)
+
+@pytest.mark.parametrize("replace",[False,True])
+@pytest.mark.parametrize("counts",[[[2,0,3,1],[4,1,0,2]],[[0,1,0,2],[0,1,0,1]]])
+def test_evaluate_alloc_matches_monte_carlo(replace,counts):
+    """the exact maximum, probability of no score, exceedance and expected counts of two rounds agree with Monte Carlo within 4 standard errors (the second allocation often draws no score)"""
+    da = make_scores(4,8,seed=3,nan_fraction=0.3)
+    values = da.values
+    values[1,1:] = np.nan
+    values[3] = np.nan
+    thresholds = [0.,1.5]
+    exact = ea.evaluate_alloc(da,[np.array(round_counts) for round_counts in counts],replace=replace,thresholds=thresholds)
+    draws = simulate(values,counts,replace,np.random.default_rng(0))
+    maxima = np.max(np.where(np.isnan(draws),-np.inf,draws),axis=-1)
+    scored = np.isfinite(maxima)
+    def close(estimate,samples):
+        assert abs(estimate - samples.mean()) <= 4*samples.std()/np.sqrt(len(samples)) + 1e-12
+    close(float(exact.p_no_score),(~scored).astype(float))
+    close(float(exact.expected_max),maxima[scored])
+    for i,threshold in enumerate(thresholds):
+        close(float(exact.exceedance[i]),(maxima > threshold).astype(float))
+        close(float(exact.expected_count[i]),np.sum(draws > threshold,axis=-1).astype(float))
+
+def test_alloc_counts_of_dict_and_array():
+    """an allocation dict and its array per lead_ID give the same counts"""
+    lead_list = ["L0","L1","L2"]
+    np.testing.assert_array_equal(ea.alloc_counts({"L2": 3, "L0": 1},lead_list),[1,0,3])
+    np.testing.assert_array_equal(ea.alloc_counts(np.array([1,0,3]),lead_list),[1,0,3])
@@ -0,0 +1,34 @@
+import numpy as np
+import xarray as xr
+import pytest
+import bootstrap_alloc as ba
+
+def test_halving_stages():
+    """stages multiply the replicates by eta up to max_bootstrap, and eta <= 1 or min_bootstrap <= 0 are rejected"""
+    assert ba.halving_stages(50,800,2) == [50,100,200,400,800]
+    assert ba.halving_stages(50,300,3) == [50,150,300]
+    for min_bootstrap, eta in [(50,1),(50,0.5),(0,2)]:
+        with pytest.raises(ValueError):
+            ba.halving_stages(min_bootstrap,800,eta)
+
+def test_prune():
+    """the best 1/eta cells are kept, with the cells within z standard errors of the cut, unless the cut has no standard error"""
+    means = {"a": 3., "b": 2., "c": 1.9, "d": 0.}
+    ses = {"a": 1., "b": 0.1, "c": 0.1, "d": 0.1}
+    assert ba.prune(means,ses) == ["a","b","c"]
+    assert ba.prune(means,ses,z=None) == ["a","b"]
+    assert ba.prune(means,dict(ses,b=np.inf)) == ["a","b"]
+
+def test_exceedance_needs_threshold(scores,tmp_path):
+    """metric exceedance without a threshold is rejected before any stage runs"""
+    with pytest.raises(ValueError):
+        ba.score_halving(scores,[2],[5],[3],2,"h",metric="exceedance",output_path=f"{tmp_path}/")
+
+def test_score_halving(scores,tmp_path):
+    """cells pruned at different stages are gathered with NaN padded replicates"""
+    ba.score_halving(scores,[2,4],[5],[2,3],2,"h",min_bootstrap=4,max_bootstrap=8,z=None,seed=3,output_path=f"{tmp_path}/")
+    out = xr.load_dataset(f"{tmp_path}/score_info_h.nc")
+    assert out.sizes["bootstrap"] == 8
+    assert sorted(out.last_stage.values.ravel()) == [0,0,1,1]
+    pruned = out.score.where(out.last_stage == 0).notnull().any(["alloc_type","round","distribution_value"])
+    assert not pruned.sel(bootstrap=slice(4,None)).any()
@@ -0,0 +1,38 @@
+import os
+import numpy as np
+import xarray as xr
+import pytest
+import preproc as pc
+from utils import read_area
+
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","code")
+
+@pytest.fixture
+def field(monkeypatch):
+    """global daily field with missing values, and one time step without any value. areas are read relative to code/, weights are not kept in memory between tests"""
+    monkeypatch.chdir(CODE)
+    monkeypatch.setattr(pc,"_area_weights",{})
+    rng = np.random.default_rng(0)
+    lat = np.arange(-89.5,90,1.)
+    lon = np.arange(0.5,360,1.)
+    values = rng.normal(size=(3,len(lat),len(lon)))
+    values[rng.random(values.shape) < 0.3] = np.nan
+    values[2] = np.nan
+    return xr.Dataset({"TREFHTMX": (("time","lat","lon"),values)},coords={"time": range(3),"lat": lat,"lon": lon})
+
+@pytest.mark.parametrize("area",["PNW","MID"])
+def test_box_mean_skips_missing_values(field,tmp_path,area):
+    """the area mean is the cos(lat) weighted mean of the valid values in the box, NaN without any"""
+    [min_lat,max_lat,min_lon,max_lon] = read_area(area)
+    box = field.TREFHTMX.sel(lat=slice(min_lat,max_lat),lon=slice(min_lon,max_lon))
+    expected = box.weighted(np.cos(np.deg2rad(box.lat))).mean(("lat","lon"))
+    result = pc.preprocess(field,"box",area,cache_dir=f"{tmp_path}/").TREFHTMX
+    xr.testing.assert_allclose(result,expected)
+    assert np.isnan(result[2])
+
+def test_weights_cache_keyed_by_area_definition(field,tmp_path):
+    """cached weights files are named by the area definition and the grid, and reused"""
+    pc.area_weights(field,"box","PNW",cache_dir=f"{tmp_path}/")
+    names = os.listdir(tmp_path)
+    assert names == [f"weights_PNW_box_{pc.area_key('PNW','box')}_{pc.grid_key(field)}.nc"]
+    assert pc.area_key("PNW","box") != pc.area_key("MID","box")
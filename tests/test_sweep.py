@@ -0,0 +1,43 @@
+import numpy as np
+import xarray as xr
+import pytest
+import bootstrap_alloc as ba
+import sweep_store as ss
+
+GRID = dict(n_tops=[2,4],n_batchs=[5],n_batch_starts=[2,3],len_loop=2,bootstrap=6)
+
+def run_sweep(ds,output_path,save_info="t",**kwargs):
+    """runs a small sweep into the folder output_path (a pathlib.Path) and returns its loaded output"""
+    output_path = f"{output_path}/"
+    ba.score_diff_config(ds,GRID["n_tops"],GRID["n_batchs"],GRID["n_batch_starts"],GRID["len_loop"],GRID["bootstrap"],save_info,seed=7,output_path=output_path,**kwargs)
+    return xr.load_dataset(f"{output_path}score_info_{save_info}.nc")
+
+@pytest.mark.parametrize("replace",[False,True])
+def test_sweep_same_for_any_n_workers(scores,tmp_path,replace):
+    """each grid cell draws from its own random stream, so the output does not depend on the number of worker processes"""
+    serial = run_sweep(scores,tmp_path / "serial",replace=replace)
+    parallel = run_sweep(scores,tmp_path / "parallel",replace=replace,n_workers=2)
+    xr.testing.assert_identical(serial,parallel)
+
+def test_common_random_numbers(scores,tmp_path):
+    """with common random numbers, the cells of an n_batch_start share their screening, and the output still does not depend on n_workers"""
+    serial = run_sweep(scores,tmp_path / "serial",common=True)
+    parallel = run_sweep(scores,tmp_path / "parallel",common=True,n_workers=2)
+    xr.testing.assert_identical(serial,parallel)
+    screening = serial.score.sel(round=0,batch_size=5)
+    xr.testing.assert_equal(screening.sel(top_length=2,drop=True),screening.sel(top_length=4,drop=True))
+    independent = run_sweep(scores,tmp_path / "independent").score.sel(round=0,batch_size=5)
+    assert not independent.sel(top_length=2,drop=True).equals(independent.sel(top_length=4,drop=True))
+
+def test_resume_after_deleted_cell(scores,tmp_path):
+    """a restarted sweep runs again only the cells that are missing from its store, and gives the same output"""
+    first = run_sweep(scores,tmp_path)
+    store = tmp_path / "score_info_t"
+    kept = store / ss.cell_name((2,5,4))
+    deleted = store / ss.cell_name((3,5,2))
+    kept_time = kept.stat().st_mtime_ns
+    deleted.unlink()
+    resumed = run_sweep(scores,tmp_path)
+    xr.testing.assert_identical(first,resumed)
+    assert deleted.exists()
+    assert kept.stat().st_mtime_ns == kept_time
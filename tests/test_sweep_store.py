@@ -0,0 +1,25 @@
+import numpy as np
+import xarray as xr
+import pytest
+import bootstrap_alloc as ba
+import sweep_store as ss
+
+@pytest.fixture
+def score_info(scores):
+    """dense score_info of one grid cell"""
+    return ba.score_algo_batched(scores,3,5,2,3,4,rng=np.random.default_rng(1))
+
+def test_ragged_round_trip(score_info):
+    """a ragged score_info decodes back to the dense one"""
+    decoded = ss.decode_score_info(ss.encode_score_info(score_info,"ragged"))
+    dense = score_info.assign_attrs(encoding="dense")
+    xr.testing.assert_identical(decoded.transpose(*dense.score.dims,...),dense.transpose(*dense.score.dims,...))
+
+def test_summary_statistics(score_info):
+    """the summary keeps the maximum, quantiles and exceedance counts of the scores of each round"""
+    summary = ss.encode_score_info(score_info,"summary",quantiles=[0.5],thresholds=[0.,1.])
+    xr.testing.assert_equal(summary.score_max,score_info.score.max("distribution_value"))
+    xr.testing.assert_allclose(summary.score_quantile.sel(quantile=0.5,drop=True),score_info.score.median("distribution_value"))
+    expected = (score_info.score > xr.DataArray([0.,1.],dims="threshold",coords={"threshold": [0.,1.]})).sum("distribution_value")
+    xr.testing.assert_equal(summary.exceedance.astype(int),expected.transpose(*summary.exceedance.dims))
+    np.testing.assert_array_equal(summary.score_count,score_info.score.notnull().sum("distribution_value"))
@@ -0,0 +1,29 @@
+import timing as tm
+import bootstrap_alloc as ba
+
+def test_recording_restores_caller_state():
+    """recording() times the wrapped code from empty stats, and gives back the caller's enabled flag and stats"""
+    for enabled in [False,True]:
+        tm.enable(enabled)
+        tm.reset()
+        with tm.phase("outer",2):
+            pass
+        before = tm.stats()
+        with tm.recording():
+            assert tm.is_enabled()
+            with tm.phase("inner",lambda: 3):
+                pass
+            inner = tm.stats()
+        assert list(inner) == ["inner"]
+        assert inner["inner"]["items"] == 3
+        assert tm.is_enabled() == enabled
+        assert tm.stats() == before
+    tm.enable(False)
+    tm.reset()
+
+def test_timed_sweep_leaves_timing_off(scores,tmp_path):
+    """a timed sweep run in process saves the timings of each cell without turning the timing on"""
+    ba.score_diff_config(scores,[2],[5],[3],2,4,"t",seed=7,output_path=f"{tmp_path}/",timed=True)
+    assert not tm.is_enabled()
+    total = tm.load_json(f"{tmp_path}/score_info_t_timing.json")["total"]
+    assert total["cell"]["calls"] == 1
@@ -1,86 +1,228 @@
 import numpy as np
+import timing as tm
+from numpy.random import default_rng
+rng = default_rng()
 
-def find_alloc_static(top_events,n_top,n_batch):
-    """allocates amount of new samples to draw for each lead time, by giving n_batch number of new samples for each event in that lead time that was in the top selection"""
+def merge_top(top,top_codes,scores,codes,n_top,top_ties=None,ties=None):
+    """Merges new scores into a pool of top events, keeping only the n_top highest (NaN counts as lowest), so that the pool never has to be fully re-sorted. Works along the last axis, for any leading (replicate) dimensions.
+        :param top: array of top scores so far (..., at most n_top), sorted descending
+        :param top_codes: integer lead codes of top
+        :param scores: array of new scores (..., n_new), may contain NaN
+        :param codes: integer lead codes of scores (..., n_new)
+        :param n_top: values of n_top (length of top events to use for allocation)
+        :param top_ties: optional (1d only, with ties). integer tie-break keys of top
+        :param ties: optional (1d only). integer tie-break keys of scores: equal scores are ordered by decreasing key (e.g. the position in the stacked (member, lead_ID) order, like sortby(ascending=False)). If None, tied scores at the n_top cut are kept arbitrarily
+        returns [top scores sorted descending, their lead codes] (and their tie-break keys, with ties)"""
+    with tm.phase("merge_top",lambda: np.size(scores)):
+        values = np.concatenate([top,scores],axis=-1)
+        values_codes = np.concatenate([top_codes,codes],axis=-1)
+        key = np.where(np.isnan(values),np.inf,-values)
+        if ties is not None:
+            values_ties = np.concatenate([top_ties,ties])
+            if len(values) > n_top:
+                # all events tied with the n_top-th one are candidates, the tie-break keys decide among them
+                cut = key[np.argpartition(key,n_top-1)[:n_top]].max()
+                candidates = np.flatnonzero(key <= cut)
+            else:
+                candidates = np.arange(len(values))
+            order = candidates[np.lexsort((-values_ties[candidates],key[candidates]))][:n_top]
+            return values[order], values_codes[order], values_ties[order]
+        if values.shape[-1] > n_top:
+            part = np.argpartition(key,n_top-1,axis=-1)[...,:n_top]
+            values = np.take_along_axis(values,part,axis=-1)
+            values_codes = np.take_along_axis(values_codes,part,axis=-1)
+            key = np.take_along_axis(key,part,axis=-1)
+        order = np.argsort(key,axis=-1,kind="stable")
+        return np.take_along_axis(values,order,axis=-1), np.take_along_axis(values_codes,order,axis=-1)
+
+def lead_codes(top_events,n_top):
+    """returns the first n_top events of a sorted DataArray of events with a lead_ID coordinate as [scores, integer lead codes, lead_IDs of the codes (in order of first appearance)]"""
     rank_list = top_events[0:n_top] #top events
-    occ_per_lead_ID = {} # dict containing amount of new realizations per lead time
+    labels = [f"{ld}" for ld in rank_list.lead_ID.values]
+    lead_IDs = list(dict.fromkeys(labels))
+    index = {lead_ID: i for i,lead_ID in enumerate(lead_IDs)}
+    return rank_list.values, np.array([index[ld] for ld in labels],dtype=int), lead_IDs
+
+def to_lead_codes(alloc,codes,n_leads):
+    """sums an allocation per top event (n_rep, n_top) into an allocation per lead code (n_rep, n_leads)"""
+    n_rep = alloc.shape[0]
+    flat = (codes + n_leads*np.arange(n_rep)[:,None]).ravel()
+    return np.bincount(flat,weights=alloc.ravel(),minlength=n_rep*n_leads).reshape(n_rep,n_leads).astype(int)
+
+def find_alloc_static_batched(top_scores,top_codes,n_top,n_batch,n_leads):
+    """allocates amount of new samples to draw for each lead code, by giving n_batch/n_top new samples for each top event, for many replicates at once
+        :param top_scores: (replicate, event) array of top scores, sorted descending and NaN padded (see merge_top)
+        :param top_codes: (replicate, event) array of integer lead codes of top_scores
+        :param n_top: values of n_top (length of top events to use for allocation)
+        :param n_batch: value of n_batch (batch size for each allocation round)
+        :param n_leads: number of lead codes
+        returns (replicate, n_leads) array of new realizations per lead code"""
+    top_scores = top_scores[:,:n_top]
+    top_codes = top_codes[:,:n_top]
+    n_valid = np.sum(~np.isnan(top_scores),axis=-1)
+    rank = np.arange(top_scores.shape[-1])
     # need to allocate n_batch/n_top per top event, but can only allocate round numbers. excess will be distributated among the top of the top
     new_batch = int(n_batch/n_top)
     diff = n_batch - new_batch*n_top
-    for i,mx in enumerate(rank_list):
-        #distribute excess (if there is any)
-        if diff > 0:
-            allocate_here = new_batch + 1
-            diff -= 1
-        else:
-            allocate_here = new_batch
-        #allocate new realizationa
-        if f"{mx.lead_ID.values}" in occ_per_lead_ID.keys():
-            occ_per_lead_ID[f"{mx.lead_ID.values}"] += allocate_here
-        else:
-            occ_per_lead_ID[f"{mx.lead_ID.values}"] = allocate_here
-    if diff > 0:
-        occ_per_lead_ID[f"{rank_list[0].lead_ID.values}"] += diff
-    return occ_per_lead_ID
+    alloc = np.where(rank < diff, new_batch + 1, new_batch)*(rank < n_valid[:,None])
+    # excess left when there are less than n_top events goes to the top event
+    if alloc.shape[-1] > 0:
+        alloc[:,0] += np.where(n_valid > 0, np.maximum(diff - n_valid,0), 0)
+    return to_lead_codes(alloc,top_codes,n_leads)
+
+def find_alloc_weighted_batched(top_scores,top_codes,n_top,n_batch,n_leads):
+    """allocates amount of new samples to draw for each lead code, by weighting the top events by how far they are from the top 1 event, for many replicates at once
+        :param top_scores: (replicate, event) array of top scores, sorted descending and NaN padded (see merge_top)
+        :param top_codes: (replicate, event) array of integer lead codes of top_scores
+        :param n_top: values of n_top (length of top events to use for allocation)
+        :param n_batch: value of n_batch (batch size for each allocation round)
+        :param n_leads: number of lead codes
+        returns (replicate, n_leads) array of new realizations per lead code"""
+    top_scores = top_scores[:,:n_top]
+    top_codes = top_codes[:,:n_top]
+    n_rep = top_scores.shape[0]
+    if top_scores.shape[-1] == 0:
+        return np.zeros((n_rep,n_leads),dtype=int)
+    n_valid = np.sum(~np.isnan(top_scores),axis=-1)
+    rank = np.arange(top_scores.shape[-1])
+    last = top_scores[np.arange(n_rep),np.maximum(n_valid-1,0)]
+    total_dist = top_scores[:,0] - last
+    weighted = (n_valid > 1) & (total_dist != 0)
+    # distance of each top event to the last one
+    relative_dists = np.where((rank < n_valid[:,None]) & weighted[:,None], top_scores - last[:,None], 0.)
+    # normalize weights so total new allocated round correspond ~ to n_batch (sequential sum, to round like the python sum)
+    total = np.cumsum(relative_dists,axis=-1)[:,-1]
+    with np.errstate(divide="ignore",invalid="ignore"):
+        weights = np.where(weighted[:,None], relative_dists*n_batch/total[:,None], 0.).astype(int)
+    # add 1 more sample to allocate for each weight until total new allocated round correspond exactly to n_batch
+    diff = n_batch - weights.sum(axis=-1)
+    alloc = weights + ((rank < diff[:,None]) & (rank < n_valid[:,None]))
+    alloc[:,0] += np.maximum(diff - n_valid,0)
+    # a single event gets everything
+    alloc[n_valid == 1] = 0
+    alloc[n_valid == 1,0] = n_batch
+    alloc_leads = to_lead_codes(alloc,top_codes,n_leads)
+    # if all values are the same, allocate statically
+    static = (n_valid > 1) & ~weighted
+    if static.any():
+        alloc_leads[static] = find_alloc_static_batched(top_scores[static],top_codes[static],n_top,n_batch,n_leads)
+    return alloc_leads
+
+def find_alloc_static_array(top_scores,top_codes,n_top,n_batch,n_leads):
+    """single replicate version of find_alloc_static_batched: takes 1d top_scores and top_codes, returns an array of new realizations per lead code"""
+    return find_alloc_static_batched(top_scores[None],top_codes[None],n_top,n_batch,n_leads)[0]
+
+def find_alloc_weighted_array(top_scores,top_codes,n_top,n_batch,n_leads):
+    """single replicate version of find_alloc_weighted_batched: takes 1d top_scores and top_codes, returns an array of new realizations per lead code"""
+    return find_alloc_weighted_batched(top_scores[None],top_codes[None],n_top,n_batch,n_leads)[0]
+
+def find_alloc_static(top_events,n_top,n_batch):
+    """allocates amount of new samples to draw for each lead time, by giving n_batch number of new samples for each event in that lead time that was in the top selection"""
+    scores, codes, lead_IDs = lead_codes(top_events,n_top)
+    alloc = find_alloc_static_array(scores,codes,n_top,n_batch,len(lead_IDs))
+    return {lead_ID: int(alloc[i]) for i,lead_ID in enumerate(lead_IDs)} # dict containing amount of new realizations per lead time
 
 def find_alloc_weighted(top_events,n_top,n_batch):
     """allocates amount of new samples to draw for each lead time, by weighting the top runs by how far they are from the top 1 event"""
-    rank_list = top_events[0:n_top] #top events 
-    occ_per_lead_ID = {}
-    if len(rank_list) > 1:
-        total_dist = rank_list[0]-rank_list[-1]
-        if total_dist == 0 : # if all values are the same
-            return find_alloc_static(top_events,n_top,n_batch)
-        relative_dists = np.zeros(n_top)
-        # find the ratio of relative distande/total distance
-        for i,rk in enumerate(rank_list):
-            relative_dists[i] = (rk - rank_list[-1])
-            
-        # normalize weights so total new allocated round correspond ~ to n_batch
-        weights = [int(r*(n_batch)/sum(relative_dists)) for r in relative_dists]
-        # add 1 more sample to allocate for each weight until total new allocated round correspond exactly to n_batch
-        diff = n_batch-sum(weights)
-        # allocate to dict of lead times
-        for i, rk in enumerate(rank_list):
-            if diff > 0:
-                allocate_here = weights[i] + 1
-                diff -= 1
-            else:
-                allocate_here = weights[i]
-            if f"{rk.lead_ID.values}" in occ_per_lead_ID.keys():
-                occ_per_lead_ID[f"{rk.lead_ID.values}"] += allocate_here
-            else:
-                occ_per_lead_ID[f"{rk.lead_ID.values}"] = allocate_here
-        if diff > 0:
-            occ_per_lead_ID[f"{rank_list[0].lead_ID.values}"] += diff 
-    else:
-        occ_per_lead_ID[f"{rank_list[0].lead_ID.values}"] = n_batch
-    return occ_per_lead_ID
-
-def find_random_alloc(size, lead_IDs):
-    """allocates amount of new samples to draw for each lead time, by drawing random samples from any lead time, in total amounting to size"""
-    occ_per_lead_ID = {}
-    for i in range(size):
-        lead_ID = rng.choice(lead_IDs, size=1,replace=True)[0]
-        if f"{lead_ID}" in occ_per_lead_ID:
-            occ_per_lead_ID[f"{lead_ID}"] += 1
-        else:
-            occ_per_lead_ID[f"{lead_ID}"] = 1
-    for ld in lead_IDs.values:
-        if f"{ld}" not in occ_per_lead_ID.keys():
-            occ_per_lead_ID[f"{ld}"] = 0
-    return occ_per_lead_ID
+    scores, codes, lead_IDs = lead_codes(top_events,n_top)
+    alloc = find_alloc_weighted_array(scores,codes,n_top,n_batch,len(lead_IDs))
+    return {lead_ID: int(alloc[i]) for i,lead_ID in enumerate(lead_IDs)}
+
+def scored_members(values):
+    """returns the number of scored (non-NaN) members of each lead code of a dense (..., lead_ID, member) score array: the weights of Random allocation, which draws lead codes in proportion to them (so events regardless of their scores)"""
+    return np.sum(~np.isnan(values),axis=-1)
+
+def find_random_alloc_batched(n_rep,n_batch,n_leads,weights=None,rng=rng):
+    """allocates amount of new samples to draw for each lead code, by drawing n_batch samples at random from any lead code (one multinomial draw per replicate), for many replicates at once
+        :param n_rep: number of replicates
+        :param n_batch: value of n_batch (batch size for each allocation round)
+        :param n_leads: number of lead codes
+        :param weights: optional. (n_leads) or (replicate, n_leads) weights of the lead codes (e.g. their number of scored members). If None, all lead codes are equally likely
+        :param rng: optional. numpy random generator to draw from
+        returns (replicate, n_leads) array of new realizations per lead code"""
+    if weights is None:
+        weights = np.ones(n_leads)
+    weights = np.broadcast_to(np.asarray(weights,dtype=float),(n_rep,n_leads))
+    total = weights.sum(axis=-1,keepdims=True)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        pvals = np.where(total > 0,weights/total,0.)
+    if n_leads == 0:
+        return np.zeros((n_rep,0),dtype=int)
+    alloc = rng.multinomial(n_batch,pvals)
+    # replicates without any lead code to draw from get nothing
+    alloc[total[:,0] == 0] = 0
+    return alloc
 
-def find_alloc(alloc_type,lead_IDs,top_events,n_top,n_batch):
+def find_random_alloc(size, lead_IDs, rng=rng):
+    """allocates amount of new samples to draw for each lead time, by drawing random samples from any lead time, in total amounting to size. 
+    lead_IDs is the lead_ID of each event to draw from, so lead times are drawn in proportion to their number of events. returns dict of {lead_ID: amount} in order of first occurrence in lead_IDs"""
+    labels, first, n_events = np.unique([f"{ld}" for ld in np.asarray(lead_IDs).ravel()],return_index=True,return_counts=True)
+    order = np.argsort(first)
+    labels, n_events = labels[order], n_events[order]
+    alloc = find_random_alloc_batched(1,size,len(labels),weights=n_events,rng=rng)[0]
+    return {str(lead_ID): int(alloc[i]) for i,lead_ID in enumerate(labels)}
+
+def find_alloc(alloc_type,lead_IDs,top_events,n_top,n_batch,rng=rng):
     """TODO: write description"""
     #find allocation for next round
     if alloc_type == "Static":
         lead_dict = find_alloc_static(top_events,n_top,n_batch)
     elif alloc_type == "Random":
-        lead_dict = find_random_alloc(n_batch,lead_IDs)
+        lead_dict = find_random_alloc(n_batch,lead_IDs,rng=rng)
     elif alloc_type == "Weighted":
         lead_dict = find_alloc_weighted(top_events,n_top,n_batch)    
     else:
         print("input valid score type")
     return lead_dict
 
+def find_alloc_batched(alloc_type,top_scores,top_codes,n_top,n_batch,n_leads,weights=None,rng=rng):
+    """finds the allocation for next round for many replicates at once, from (replicate, event) arrays of top scores and lead codes. 
+    "Random" ignores the top events and draws from the lead codes by weights (see find_random_alloc_batched). returns (replicate, n_leads) array of new realizations per lead code"""
+    with tm.phase("allocation",len(top_scores)):
+        if alloc_type == "Static":
+            return find_alloc_static_batched(top_scores,top_codes,n_top,n_batch,n_leads)
+        elif alloc_type == "Weighted":
+            return find_alloc_weighted_batched(top_scores,top_codes,n_top,n_batch,n_leads)
+        elif alloc_type == "Random":
+            return find_random_alloc_batched(len(top_scores),n_batch,n_leads,weights=weights,rng=rng)
+        else:
+            raise ValueError(f"alloc_type {alloc_type} has no array allocation")
+
+def find_alloc_array(alloc_type,top_scores,top_codes,n_top,n_batch,n_leads,weights=None,rng=rng):
+    """single replicate version of find_alloc_batched. returns an array of new realizations per lead code"""
+    return find_alloc_batched(alloc_type,top_scores[None],top_codes[None],n_top,n_batch,n_leads,weights=weights,rng=rng)[0]
+
+# === Out-of-core top events of a score file ===
+TOP_CHUNK_ELEMENTS = 2**22 # max number of scores read at once by chunked_top
+
+def chunked_top(da,n_top,chunk_size=None,lead_dim="lead_ID",member_dim="member"):
+    """Finds the n_top highest scores of a (lazily opened) DataArray of scores (lead_ID, member), reading chunk_size lead_IDs at a time and keeping only a running top (see merge_top), so the stacked or sorted scores are never held in memory.
+        :param da: DataArray with dimensions lead_dim and member_dim, e.g. from xr.open_dataset (not loaded)
+        :param n_top: values of n_top (length of top events to use for allocation)
+        :param chunk_size: optional. number of lead_IDs read at once, default so that a chunk holds about TOP_CHUNK_ELEMENTS scores
+        returns [top scores sorted descending (without NaN), their lead codes (positions along lead_dim), lead_dim coordinate]"""
+    n_leads = da.sizes[lead_dim]
+    if chunk_size is None:
+        chunk_size = max(1,TOP_CHUNK_ELEMENTS//max(da.sizes[member_dim],1))
+    top, top_codes, top_ties = np.empty(0), np.empty(0,dtype=int), np.empty(0,dtype=np.int64)
+    for start in range(0,n_leads,chunk_size):
+        values = da.isel({lead_dim: slice(start,start+chunk_size)}).transpose(lead_dim,member_dim).values
+        codes = np.broadcast_to(np.arange(start,start+values.shape[0])[:,None],values.shape)
+        # ties are broken like sorting the (member, lead_ID) stacked scores with sortby(ascending=False): last in the stacked order first
+        ties = np.arange(values.shape[1],dtype=np.int64)[None,:]*n_leads + codes
+        top, top_codes, top_ties = merge_top(top,top_codes,values.ravel(),codes.ravel(),n_top,top_ties=top_ties,ties=ties.ravel())
+    valid = ~np.isnan(top)
+    return top[valid], top_codes[valid], da[lead_dim].values
+
+def find_alloc_top(alloc_type,top_scores,top_codes,lead_labels,n_top,n_batch):
+    """Finds the allocation for next round from arrays of top scores (sorted descending) and their lead codes, like find_alloc does from a sorted DataArray.
+        :param lead_labels: lead_ID of each lead code
+        returns dict of new realizations per lead_ID of the top events (in order of first appearance in the top)"""
+    # lead codes renumbered in order of first appearance, like lead_codes
+    unique, first, inverse = np.unique(top_codes[:n_top],return_index=True,return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    lead_IDs = [f"{lead_labels[code]}" for code in unique[order]]
+    alloc = find_alloc_array(alloc_type,top_scores[:n_top],rank[inverse.reshape(-1)],n_top,n_batch,len(lead_IDs))
+    return {lead_ID: int(alloc[i]) for i,lead_ID in enumerate(lead_IDs)}
@@ -0,0 +1,120 @@
+import alloc as ac
+import utils as ut
+import json
+import numpy as np
+import xarray as xr
+
+# === Incremental allocation state of a live boosting campaign ===
+# Instead of re-reading, stacking and sorting all boosted scores after each batch, the state keeps the n_top best events (scores and lead codes) and which (lead_ID, member) were already scored.
+# New scores are merged into the top pool (see alloc.merge_top), members already seen are skipped, so a growing file can be ingested again after every batch.
+# The state is a dict of json types and numpy arrays, snapshotted to json for restarts
+# ==========================
+
+MEMBER_BITS = 32 # an event (lead code, member) is stored as the key lead code * 2**MEMBER_BITS + member
+LEAD_BITS = 32 # tied scores are ordered by decreasing member * 2**LEAD_BITS + lead code, like the sorted (member, lead_ID) stack of allocation_algorithm.py
+
+def new_state(n_top,n_batch,alloc_type="Weighted"):
+    """returns an empty allocation state keeping the n_top best events, with default batch size n_batch and allocation type alloc_type"""
+    return {
+        "n_top": n_top,
+        "n_batch": n_batch,
+        "alloc_type": alloc_type,
+        "lead_IDs": [], # lead_ID of each lead code, in order of first appearance
+        "seen": np.empty(0,dtype=np.int64), # sorted keys of the (lead code, member) already ingested
+        "top": np.empty(0),
+        "top_codes": np.empty(0,dtype=int),
+        "top_ties": np.empty(0,dtype=np.int64), # tie-break keys of the top events (see LEAD_BITS)
+        "n_events": 0, # number of scored (non-NaN) events ingested
+    }
+
+def lead_codes(state,lead_IDs):
+    """returns the array of lead codes of lead_IDs, adding the new lead_IDs to the state"""
+    lead_IDs = np.asarray(lead_IDs)
+    if lead_IDs.dtype.kind != "U":
+        lead_IDs = lead_IDs.astype(str)
+    index = {lead_ID: i for i,lead_ID in enumerate(state["lead_IDs"])}
+    unique, first, inverse = np.unique(lead_IDs,return_index=True,return_inverse=True)
+    for lead_ID in unique[np.argsort(first)]:
+        if lead_ID not in index:
+            index[lead_ID] = len(state["lead_IDs"])
+            state["lead_IDs"].append(str(lead_ID))
+    return np.array([index[lead_ID] for lead_ID in unique],dtype=int)[inverse].reshape(-1)
+
+def ingest(state,lead_IDs,members,scores):
+    """Adds new scored events to the state. Events with a NaN score or a (lead_ID, member) already ingested are skipped.
+        :param state: allocation state (see new_state), updated in place
+        :param lead_IDs: lead_ID of each event
+        :param members: (integer) member of each event
+        :param scores: score of each event
+        returns number of new events"""
+    scores = np.asarray(scores,dtype=float).reshape(-1)
+    valid = ~np.isnan(scores)
+    scores = scores[valid]
+    members = np.asarray(members,dtype=np.int64).reshape(-1)[valid]
+    codes = lead_codes(state,np.asarray(lead_IDs).reshape(-1)[valid])
+    keys = (codes.astype(np.int64) << MEMBER_BITS) + members
+    # first occurrence of each event not ingested before
+    keys, first = np.unique(keys,return_index=True)
+    new = ~np.isin(keys,state["seen"],assume_unique=True)
+    first = np.sort(first[new])
+    state["seen"] = np.union1d(state["seen"],keys[new])
+    ties = (members[first] << LEAD_BITS) + codes[first]
+    state["top"], state["top_codes"], state["top_ties"] = ac.merge_top(state["top"],state["top_codes"],scores[first],codes[first],state["n_top"],top_ties=state["top_ties"],ties=ties)
+    state["n_events"] += len(first)
+    return len(first)
+
+def ingest_file(state,path,var="score"):
+    """adds the events of a .nc file with variable var over dimensions (lead_ID, member) to the state (see ingest). returns number of new events"""
+    with xr.open_dataset(path) as ds:
+        da = ds[var].transpose("lead_ID","member")
+        values = da.values
+        lead_IDs = np.repeat(da.lead_ID.values,values.shape[1])
+        members = np.tile(da.member.values,values.shape[0])
+    return ingest(state,lead_IDs,members,values.ravel())
+
+def allocation(state,n_batch=None,alloc_type=None,n_top=None):
+    """Finds the allocation of the next round from the top pool of the state, like alloc.find_alloc.
+        :param n_batch: optional. batch size, default the one of the state
+        :param alloc_type: optional. "Static" or "Weighted", default the one of the state
+        :param n_top: optional. number of top events to use, at most the n_top of the state (default)
+        returns dict of new realizations per lead_ID of the top events (in order of first appearance in the top)"""
+    n_batch = state["n_batch"] if n_batch is None else n_batch
+    alloc_type = state["alloc_type"] if alloc_type is None else alloc_type
+    n_top = state["n_top"] if n_top is None else n_top
+    if alloc_type not in ["Static","Weighted"]:
+        raise ValueError(f"alloc_type should be 'Static' or 'Weighted' (allocations from the top events), not {alloc_type}")
+    if n_top > state["n_top"]:
+        raise ValueError(f"state only keeps the top {state['n_top']} events, can not allocate from the top {n_top}")
+    alloc = ac.find_alloc_array(alloc_type,state["top"],state["top_codes"],n_top,n_batch,len(state["lead_IDs"]))
+    codes = dict.fromkeys(state["top_codes"][:n_top].tolist())
+    return {state["lead_IDs"][code]: int(alloc[code]) for code in codes}
+
+def status(state):
+    """returns a json summary of the state"""
+    return {
+        "n_top": state["n_top"],
+        "n_batch": state["n_batch"],
+        "alloc_type": state["alloc_type"],
+        "n_leads": len(state["lead_IDs"]),
+        "n_events": state["n_events"],
+        "top": [[state["lead_IDs"][code], score] for score, code in zip(state["top"].tolist(),state["top_codes"].tolist())],
+    }
+
+def save_snapshot(state,path):
+    """saves the state to a json file (see utils.atomic_write)"""
+    content = dict(state,
+                   seen=state["seen"].tolist(),
+                   top=state["top"].tolist(),
+                   top_codes=state["top_codes"].tolist(),
+                   top_ties=state["top_ties"].tolist())
+    ut.write_json(content,path)
+
+def load_snapshot(path):
+    """loads a state saved with save_snapshot"""
+    with open(path,"r") as f:
+        state = json.load(f)
+    state["seen"] = np.array(state["seen"],dtype=np.int64)
+    state["top"] = np.array(state["top"],dtype=float)
+    state["top_codes"] = np.array(state["top_codes"],dtype=int)
+    state["top_ties"] = np.array(state["top_ties"],dtype=np.int64)
+    return state
@@ -0,0 +1,88 @@
+import climatology as cl
+import sweep_store as ss
+import itertools
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# === Lazy metrics of sweep outputs ===
+# A sweep output score_info_{save_info}.nc (start_batch_size, batch_size, top_length, [case,] bootstrap, alloc_type, round, ...) is opened with dask, one chunk per grid cell, so metrics are computed one cell at a time and the file is never fully in memory.
+# Every metric is reduced over bootstrap to a small DataArray over the grid, alloc_type and round, and cached in a sidecar file next to the sweep output (see climatology.cached), recomputed when the output changes.
+# Metrics work for all encodings of score_info (see sweep_store.encode_score_info)
+# ==========================
+
+GRID_DIMS = ["start_batch_size","batch_size","top_length"] # dimensions of the parameter grid of a sweep output
+
+def open_sweep(path):
+    """lazily opens a sweep output (or a single grid cell file) with dask, one chunk per grid cell"""
+    ds = xr.open_dataset(path,chunks={})
+    return ds.chunk({dim: 1 for dim in GRID_DIMS if dim in ds.dims})
+
+def round_max(ds):
+    """Returns the highest score of each round of each replicate, for any encoding. Dense and summary outputs are reduced lazily, ragged ones are decoded one grid cell at a time.
+        returns DataArray over (grid, [case,] bootstrap, alloc_type, round), NaN for rounds without score and for grid cells not run"""
+    encoding = ds.attrs.get("encoding","dense")
+    if encoding == "summary":
+        return ds.score_max
+    elif encoding == "dense":
+        return ds.score.max("distribution_value")
+    grid = [dim for dim in GRID_DIMS if dim in ds.score_value.dims]
+    if grid == []:
+        return ss.decode_score_info(ds).score.max("distribution_value")
+    cells = []
+    for index in itertools.product(*[range(ds.sizes[dim]) for dim in grid]):
+        cell = ds.isel(dict(zip(grid,index))).drop_vars(grid)
+        # one NaN of padding, so grid cells that were not run (no scores) reduce to NaN
+        cells.append(ss.decode_score_info(cell).score.pad(distribution_value=(0,1)).max("distribution_value"))
+    # back from the list of cells to the grid dimensions
+    cell_index = pd.MultiIndex.from_product([ds[dim].values for dim in grid],names=grid)
+    maxima = xr.concat(cells,dim="cell").assign_coords(xr.Coordinates.from_pandas_multiindex(cell_index,"cell"))
+    return maxima.unstack("cell").transpose(*grid,...)
+
+def best_score(ds,cumulative=True):
+    """returns the mean over bootstrap of the highest score found in each round (or up to each round if cumulative), over (grid, [case,] alloc_type, round)"""
+    maxima = round_max(ds)
+    if cumulative:
+        # running maximum over rounds, NaN until a round has a score
+        maxima = xr.apply_ufunc(np.fmax.accumulate,maxima,input_core_dims=[["round"]],output_core_dims=[["round"]],kwargs={"axis": -1},dask="parallelized").transpose(*maxima.dims)
+    return maxima.mean("bootstrap")
+
+def exceedance(ds,threshold):
+    """returns the probability (over bootstrap) that a score above threshold has been found up to each round, over (grid, [case,] alloc_type, round)"""
+    maxima = round_max(ds)
+    found = ((maxima > threshold).cumsum("round") > 0).astype(float)
+    # replicates without any score (bootstrap padding of cells with fewer replicates, grid cells not run) are left out
+    return found.where(maxima.notnull().any("round")).mean("bootstrap")
+
+def allocated(ds):
+    """returns the mean (over bootstrap) number of members drawn up to each round (screening included), over (grid, [case,] alloc_type, round)"""
+    drawn = ds.chosen_leads.sum("lead_ID",min_count=1)
+    # cumsum counts NaN as 0, so padded replicates are masked again
+    return drawn.cumsum("round").where(drawn.notnull().any("round")).mean("bootstrap")
+
+def gain(ds,alloc_type="Weighted",reference="Static"):
+    """returns the gain in mean best score found up to each round of alloc_type over reference, over (grid, [case,] round)"""
+    best = best_score(ds)
+    return best.sel(alloc_type=alloc_type,drop=True) - best.sel(alloc_type=reference,drop=True)
+
+METRICS = {"best_score": best_score, "exceedance": exceedance, "allocated": allocated, "gain": gain}
+
+def metric(path,name,cache_dir=None,**params):
+    """Computes metric name of the sweep output path (cached in a sidecar file, see climatology.cached).
+        :param path: sweep output file (score_info_{save_info}.nc)
+        :param name: "best_score", "exceedance", "allocated" or "gain"
+        :param cache_dir: optional. folder of the sidecar files, default the folder of path
+        :param params: parameters of the metric (e.g. threshold of exceedance), part of the sidecar file name
+        returns the computed DataArray"""
+    if name not in METRICS:
+        raise ValueError(f"metric should be one of {list(METRICS)}, not {name}")
+    def compute(source):
+        return METRICS[name](open_sweep(source),**params).rename(name)
+    cache_name = "_".join([name] + [f"{key}{value}" for key, value in sorted(params.items())])
+    return cl.cached(path,cache_name,compute,cache_dir)
+
+def compare(paths,name,labels=None,dim="sweep",cache_dir=None,**params):
+    """Computes metric name for several sweep outputs (e.g. of different regions or score types) and concatenates them along dim, labelled by labels (default the paths). returns DataArray"""
+    if labels is None:
+        labels = list(paths)
+    return xr.concat([metric(path,name,cache_dir=cache_dir,**params) for path in paths],dim=dim,join="outer").assign_coords({dim: list(labels)})
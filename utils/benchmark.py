@@ -0,0 +1,132 @@
+import alloc as ac
+import bootstrap_alloc as ba
+import xarray as xr
+import numpy as np
+import json
+import os
+import platform
+import tempfile
+import time
+import datetime as dt
+from numpy.random import default_rng
+
+# === Benchmarks of the allocation and bootstrap hot paths ===
+# Synthetic score datasets (lead_ID, member) of any size are generated, so timings don't depend on the boosted runs on /net/xenon.
+# Each benchmark is timed several times (best and median time kept), results are saved as json and can be compared to a saved baseline to flag regressions
+# ==========================
+
+SIZES = {"small": (20,50), "medium": (200,200), "large": (2000,1000)} # (number of lead_IDs, number of members)
+
+def synthetic_scores(n_leads,n_members,nan_fraction=0.1,seed=0):
+    """Generates a synthetic score DataArray like the output of preprocess_to_event: one mean per lead_ID plus Gumbel distributed member noise, with some missing members.
+        :param n_leads: number of lead_IDs (stacked case and lead time)
+        :param n_members: number of members per lead_ID
+        :param nan_fraction: optional. fraction of lead_IDs with missing (NaN) members, each missing up to half of its members
+        :param seed: optional. seed of the generator, so all runs time the same data
+        returns DataArray score with dimensions (lead_ID, member)"""
+    rng = default_rng(seed)
+    values = 300 + rng.normal(0,1,(n_leads,1)) + rng.gumbel(0,1,(n_leads,n_members))
+    incomplete = rng.random(n_leads) < nan_fraction
+    n_missing = rng.integers(0,n_members//2+1,n_leads) * incomplete
+    values[np.arange(n_members) >= n_members - n_missing[:,None]] = np.nan
+    lead_IDs = [str((f"{case%30+1:02d}:{2005+case//30}", lead)) for case in range(n_leads//11+1) for lead in range(-20,-9)][:n_leads]
+    return xr.DataArray(values,dims=["lead_ID","member"],coords={"lead_ID": lead_IDs,"member": range(1,n_members+1)},name="score")
+
+def time_call(func,repeat=5,number=None,min_time=0.05):
+    """times func() repeat times (each the mean of number calls), after one untimed warm-up call. returns dict of best and median time in seconds
+        :param number: optional. calls per repetition. If None, enough calls for a repetition to last min_time seconds, so short benchmarks are not dominated by timer noise"""
+    start = time.perf_counter()
+    func()
+    if number is None:
+        number = max(1,int(min_time / max(time.perf_counter() - start,1e-9)))
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {"best": min(times), "median": float(np.median(times)), "repeat": repeat, "number": number}
+
+def suite(score,n_top=10,n_batch=50,n_batch_start=5,len_loop=2,bootstrap=20):
+    """returns dict of {benchmark name: function to time} of the allocation and bootstrap hot paths on the synthetic DataArray score"""
+    values = score.transpose("lead_ID","member").values
+    n_leads = values.shape[0]
+    rng = default_rng(0)
+    sampled, lead_alloc = ba.screening(values,n_batch_start,rng=rng)
+    top, top_codes = ac.merge_top(np.empty(0),np.empty(0,dtype=int),*sampled[0],n_top)
+    # sorted DataArray of the screened events, as used by find_alloc
+    top_events = xr.DataArray(top,dims="lead_ID",coords={"lead_ID": score.lead_ID.values[top_codes]})
+    lead_alloc_top = ac.find_alloc_array("Static",top,top_codes,n_top,n_batch,n_leads)
+    benchmarks = {}
+    for alloc_type in ba.ALLOC_TYPES:
+        benchmarks[f"find_alloc_{alloc_type}"] = lambda alloc_type=alloc_type: ac.find_alloc(alloc_type,score.lead_ID,top_events,n_top,n_batch)
+        benchmarks[f"find_alloc_array_{alloc_type}"] = lambda alloc_type=alloc_type: ac.find_alloc_array(alloc_type,top,top_codes,n_top,n_batch,n_leads)
+    benchmarks["lead_ID_sample"] = lambda: ba.lead_ID_sample(values,lead_alloc_top,sampled[1].copy(),rng=rng)
+    benchmarks["lead_ID_sample_replace"] = lambda: ba.lead_ID_sample_replace(values,lead_alloc_top,rng=rng)
+    for alloc_type in ba.ALLOC_TYPES:
+        benchmarks[f"sample_score_alloc_{alloc_type}"] = lambda alloc_type=alloc_type: ba.sample_score_alloc(values,lead_alloc_top,sampled,n_top,n_batch,len_loop,alloc_type=alloc_type,rng=rng)
+    benchmarks["score_algo"] = lambda: ba.score_algo(score,n_top,n_batch,n_batch_start,len_loop,bootstrap,rng=rng)
+    benchmarks["score_algo_batched"] = lambda: ba.score_algo_batched(score,n_top,n_batch,n_batch_start,len_loop,bootstrap,rng=rng)
+    def one_cell():
+        with tempfile.TemporaryDirectory() as tmp:
+            ba.score_diff_config(score,[n_top],[n_batch],[n_batch_start],len_loop,bootstrap,"benchmark",seed=0,output_path=tmp+"/")
+    benchmarks["score_diff_config_cell"] = one_cell
+    return benchmarks
+
+def run(sizes=("small","medium"),repeat=5,skip=(),**kwargs):
+    """Runs the benchmark suite on synthetic data of each size.
+        :param sizes: names of sizes in SIZES to run
+        :param repeat: optional. number of timed repetitions of each benchmark
+        :param skip: optional. names of benchmarks not to run (e.g. the slow loop engine score_algo on large sizes)
+        :param kwargs: algorithm parameters passed to suite (n_top, n_batch, n_batch_start, len_loop, bootstrap)
+        returns dict of results (metadata and {size: {benchmark: timing}})"""
+    results = {
+        "meta": {
+            "date": dt.datetime.now().isoformat(timespec="seconds"),
+            "machine": platform.node(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "xarray": xr.__version__,
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+            "params": kwargs,
+        },
+        "results": {},
+    }
+    for size in sizes:
+        n_leads, n_members = SIZES[size]
+        score = synthetic_scores(n_leads,n_members)
+        results["results"][size] = {}
+        for name, func in suite(score,**kwargs).items():
+            if name in skip:
+                continue
+            timing = time_call(func,repeat=repeat)
+            timing.update(n_leads=n_leads,n_members=n_members)
+            results["results"][size][name] = timing
+            print(f"{size:>8} {name:<32} best {timing['best']*1e3:10.3f} ms, median {timing['median']*1e3:10.3f} ms")
+    return results
+
+def save(results,path):
+    """saves benchmark results as json"""
+    with open(path,"w") as f:
+        json.dump(results,f,indent=1)
+
+def load(path):
+    """loads benchmark results from json"""
+    with open(path,"r") as f:
+        return json.load(f)
+
+def compare(baseline,new,tolerance=0.2):
+    """Compares two benchmark results by best time, for the benchmarks they have in common.
+        :param baseline: results of the reference run
+        :param new: results to check
+        :param tolerance: optional. relative slow-down above which a benchmark counts as a regression (0.2 = 20% slower)
+        returns list of (size, benchmark, ratio new/baseline, regression or not)"""
+    rows = []
+    for size, benchmarks in new["results"].items():
+        for name, timing in benchmarks.items():
+            if name not in baseline["results"].get(size,{}):
+                continue
+            ratio = timing["best"] / baseline["results"][size][name]["best"]
+            rows.append((size,name,ratio,ratio > 1 + tolerance))
+    return rows
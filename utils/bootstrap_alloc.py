@@ -1,131 +1,109 @@
 import utils as ut 
 import alloc as ac
+import sweep_store as ss
+import timing as tm
 import xarray as xr
 import numpy as np
 from tqdm import tqdm
 from numpy.random import default_rng,randint
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+import contextlib
 rng = default_rng()
+ALLOC_TYPES = ["Static","Weighted","Random"] # allocation types run by the scoring engines, Random (events drawn regardless of their scores) being the baseline
 
 
-def lead_ID_sample(ds,lead_dict,mem_sample=False):
-    """Samples events from a dataset ds without replacement (between rounds). Batch size is determined for each lead time in the dict lead_dict.
-        :param ds: dataset that contains boosted events with dimensions lead_ID (either just lead time or stacked lead_time and case)
-        :param lead_dict: dictionary of lead_IDs, with information on how many new realizations to sample (based on screening)
-        :param mem_sample: optional. a limited sample to draw from (to not draw same event twice between rounds)
-        returns [dataset of sampled events, dictionary of non-chosen events]"""
-    samples = [] #list of sampled datasets for each lead time
-    non_chosen = {} #dict of non-sampled members (per lead time)
-    lead_ID_0_size = [] #list of lead_IDs with size 0 
-    for lead_ID in lead_dict:
-        #choose sample to draw from
-        if mem_sample == False:
-            available_events = ds.member.values
+def lead_ID_sample(values,lead_alloc,available=None,rng=rng):
+    """Samples events from a dense (lead_ID, member) array by integer member positions, without replacement (between rounds). Batch size is determined for each lead code in lead_alloc.
+        :param values: array of boosted events with dimensions (lead_ID, member) (lead_ID either just lead time or stacked lead_time and case)
+        :param lead_alloc: array with how many new realizations to sample for each lead code (based on screening)
+        :param available: optional. boolean (lead_ID, member) mask of non-chosen members (to not draw same event twice between rounds), updated in place. If None, all members can be drawn
+        :param rng: optional. numpy random generator to draw from
+        returns [array of sampled scores, array of their lead codes]"""
+    with tm.phase("sampling",lead_alloc.sum):
+        n_mem = values.shape[1]
+        leads = np.flatnonzero(lead_alloc > 0)
+        # random order of the members of each lead, non-available members last
+        keys = rng.random((len(leads),n_mem))
+        if available is None:
+            batch_size = np.minimum(lead_alloc[leads],n_mem)
         else:
-            available_events = mem_sample[lead_ID]
-        #choose batch size
-        batch_size = lead_dict[lead_ID]
-        if batch_size > len(available_events):
-            batch_size = len(available_events)
-        if batch_size ==0:
-            lead_ID_0_size.append(lead_ID)
-            non_chosen[lead_ID] = available_events
-            continue
-        #draw batch from sample of size batch_size
-        batch = rng.choice(available_events, size=batch_size,replace=False)
-        # only keep maximum values over time
-        sample_batch = ds.sel(lead_ID=lead_ID,member=batch)
-        sample_da = xr.DataArray(sample_batch.values, dims="value").pad(value=(0,len(ds.member.values)-len(batch)))
-        samples.append(sample_da)   
-        # non-sampled members
-        non_chosen[lead_ID] = list(set(available_events) - set(batch))
-    for ld in lead_ID_0_size:
-        del lead_dict[ld]
-    
-    samples = xr.concat(samples,dim="lead_ID")
-    samples["lead_ID"] = list(lead_dict.keys())
-    return samples.stack(event=("lead_ID","value")).dropna(dim="event"), non_chosen
-
-def lead_ID_sample_replace(ds,lead_dict):
-    """Samples events from a dataset ds with replacement (between rounds). Batch size is determined for each lead time in the dict lead_dict.
-        :param ds: dataset that contains boosted events with dimensions lead_ID (either just lead time or stacked lead_time and case)
-        :param lead_dict: dictionary of lead_IDs, with information on how many new realizations to sample (based on screening)
-        returns [dataset of sampled events, dictionary of non-chosen events]"""
-    samples = [] #list of sampled datasets for each lead time
-    non_chosen = {} #dict of non-sampled members (per lead time)
-    lead_ID_0_size = [] #list of lead_IDs with size 0 
-    for lead_ID in lead_dict:
-        all_lead_IDs = ds.sel(lead_ID=lead_ID).member.values
-        #choose batch size
-        batch_size = lead_dict[lead_ID]
-        if batch_size > len(all_lead_IDs):
-            batch_size = len(all_lead_IDs)
-        if batch_size ==0:
-            lead_ID_0_size.append(lead_ID)
-            continue
-        #draw batch from sample of size batch_size
-        batch = rng.choice(all_lead_IDs, size=batch_size,replace=False)
-        # only keep maximum values over time
-        sample_batch = ds.sel(lead_ID=lead_ID,member=batch)
-        sample_da = xr.DataArray(sample_batch.values, dims="value").pad(value=(0,len(ds.member.values)-len(batch)))
-        samples.append(sample_da)   
-        non_chosen[lead_ID] = all_lead_IDs # all are non-chosen, since we are replacing events (i.e. we can choose an event several times)
-    for ld in lead_ID_0_size:
-        del lead_dict[ld]
-    samples = xr.concat(samples,dim="lead_ID")
-    samples["lead_ID"] = list(lead_dict.keys())
-    return samples.stack(event=("lead_ID","value")).dropna(dim="event"), non_chosen
-
-
-def screening(ds,n_batch_start,replace=False):
+            keys[~available[leads]] = np.inf
+            batch_size = np.minimum(lead_alloc[leads],available[leads].sum(axis=-1))
+        width = batch_size.max(initial=0)
+        batch = np.argsort(keys,axis=-1)[:,:width]
+        chosen = np.arange(width) < batch_size[:,None]
+        if available is not None:
+            available[np.broadcast_to(leads[:,None],chosen.shape)[chosen],batch[chosen]] = False
+        scores = values[leads[:,None],batch][chosen]
+        codes = np.broadcast_to(leads[:,None],chosen.shape)[chosen]
+        # members without a score are drawn, but not kept
+        kept = ~np.isnan(scores)
+        return scores[kept], codes[kept]
+
+def lead_ID_sample_replace(values,lead_alloc,rng=rng):
+    """Samples events from a dense (lead_ID, member) array with replacement (between rounds). Batch size is determined for each lead code in lead_alloc.
+        :param values: array of boosted events with dimensions (lead_ID, member) (lead_ID either just lead time or stacked lead_time and case)
+        :param lead_alloc: array with how many new realizations to sample for each lead code (based on screening)
+        :param rng: optional. numpy random generator to draw from
+        returns [array of sampled scores, array of their lead codes]"""
+    # all members can be drawn every round, since we are replacing events (i.e. we can choose an event several times)
+    return lead_ID_sample(values,lead_alloc,rng=rng)
+
+def screening(values,n_batch_start,replace=False,rng=rng):
     """Performs screening (samples using blind boosting)
-        :param ds: dataset that contains boosted events with dimensions lead_ID (either just lead time or stacked lead_time and case)
+        :param values: array of boosted events with dimensions (lead_ID, member) (lead_ID either just lead time or stacked lead_time and case)
         :param n_batch_start: value of n_batch_start (batch size for screening)
         :param replace: whether or not to replace event when randomly sampled
-        returns [dataset of sampled events, dictionary of non-chosen events]"""
-    lead_dict = {}
-    for lead in ds.lead_ID:
-        lead_dict[f"{lead.values}"] = n_batch_start
-    # sample events
-    if replace == True:
-        sampled = lead_ID_sample_replace(ds,lead_dict)
-    else:
-        sampled = lead_ID_sample(ds,lead_dict)
-    return sampled,lead_dict
+        :param rng: optional. numpy random generator to draw from
+        returns [[sampled scores and lead codes, mask of non-chosen events], allocation of the screening]"""
+    with tm.phase("screening",values.shape[0]):
+        lead_alloc = np.full(values.shape[0],n_batch_start)
+        available = np.ones(values.shape,dtype=bool)
+        # sample events
+        if replace == True:
+            sampled = lead_ID_sample_replace(values,lead_alloc,rng=rng)
+        else:
+            sampled = lead_ID_sample(values,lead_alloc,available,rng=rng)
+    return [sampled,available],lead_alloc
 
 
-def sample_score_alloc(ds,lead_dict,sampled,n_top,n_batch,len_loop,alloc_type="Random",replace=False):
+def sample_score_alloc(values,lead_alloc,sampled,n_top,n_batch,len_loop,alloc_type="Random",replace=False,rng=rng):
     """Randomly samples n_batch realizations, scores them and allocates for all rounds of the allocation algorithm  
-        :param ds: dataset that contains boosted events with dimensions lead_ID (either just lead time or stacked lead_time and case)
-        :param lead_dict: dictionary of lead_IDs, with information on how many new realizations to sample (based on screening)
-        :param sampled: [dataset of sampled events, dictionary of non-chosen events]
+        :param values: array of boosted events with dimensions (lead_ID, member) (lead_ID either just lead time or stacked lead_time and case)
+        :param lead_alloc: array with how many new realizations to sample for each lead code (based on screening)
+        :param sampled: [sampled scores and lead codes, mask of non-chosen events]
         :param n_top: values of n_top (length of top events to use for allocation)
         :param n_batch: value of n_batch (batch size for each allocation round)
         :param len_loop: how many rounds of allocation to perform
-        :param alloc_type: type of allocation ("Random", "Static"or "Weighted")
+        :param alloc_type: type of allocation ("Random", "Static"or "Weighted"). Random is weighted by alloc.scored_members
         :param replace: whether or not to replace event when randomly sampled
-        returns the resulting dataset"""
+        :param rng: optional. numpy random generator to draw from
+        returns [list of sampled scores per round, list of allocations per round]"""
     scores = []
-    lead_dicts = []
-    to_analyze = sampled[0]
+    lead_allocs = []
+    # only the n_top best events are kept between rounds, as allocation only looks at those
+    top, top_codes = ac.merge_top(np.empty(0),np.empty(0,dtype=int),*sampled[0],n_top)
+    available = sampled[1].copy()
     # loop over number of rounds
     for i in range(len_loop):
-        # sample events from pool of non-chosen events, combine and sort all sampled events (from previous rounds)
+        # sample events from pool of non-chosen events, merge them into the top events (from previous rounds)
         if replace == True:
-            sampled = lead_ID_sample_replace(ds,lead_dict)
+            new_sampled = lead_ID_sample_replace(values,lead_alloc,rng=rng)
         else:
-            sampled = lead_ID_sample(ds,lead_dict,mem_sample=sampled[1])
-        combed = xr.combine_nested([to_analyze,sampled[0]],concat_dim="event")
-        to_analyze = combed.sortby(combed,ascending=False)
+            new_sampled = lead_ID_sample(values,lead_alloc,available,rng=rng)
+        top, top_codes = ac.merge_top(top,top_codes,*new_sampled,n_top)
         #scoring
-        scores.append(sampled[0].values)
+        scores.append(new_sampled[0])
         # what lead times were allocated
-        lead_dicts.append(lead_dict)
+        lead_allocs.append(lead_alloc)
         #allocation for next round
         if i < len_loop - 1:
-            lead_dict = ac.find_alloc(alloc_type,ds.lead_ID,to_analyze,n_top,n_batch)
-    return scores, lead_dicts
+            lead_alloc = ac.find_alloc_array(alloc_type,top,top_codes,n_top,n_batch,values.shape[0],weights=ac.scored_members(values),rng=rng)
+    return scores, lead_allocs
 
-def score_algo(ds,n_top,n_batch,n_batch_start,len_loop,bootstrap,replace = False):
+def score_algo(ds,n_top,n_batch,n_batch_start,len_loop,bootstrap,replace = False,rng=rng,encoding="dense",quantiles=(0.5,0.9,0.99),thresholds=None):
     """Runs the screening + allocation algorithm for set parameters, in a bootstrapped way. builds an xarray dataset for the results. 
         :param ds: dataset that contains boosted events with dimensions lead_ID (either just lead time or stacked lead_time and case)
         :param n_top: values of n_top (length of top events to use for allocation)
@@ -134,96 +112,663 @@ def score_algo(ds,n_top,n_batch,n_batch_start,len_loop,bootstrap,replace = False
         :param len_loop: how many rounds of allocation to perform
         :param bootstrap: how many times are you bootstrapping the process
         :param replace: whether or not to replace event when randomly sampled
+        :param rng: optional. numpy random generator to draw from
+        :param encoding: optional. "dense" (scores NaN padded over distribution_value), "ragged" (scores with offsets) or "summary" (per round statistics only), see sweep_store.encode_score_info
+        :param quantiles: optional. quantiles of the scores of each round kept with encoding "summary"
+        :param thresholds: optional. thresholds to count exceedances of with encoding "summary"
         returns the resulting dataset"""
     # run a sampling, scoring and allocating loop, nb of times = bootstrap
     score_info_boot = []
+    values = ds.transpose("lead_ID","member").values
     lead_list = [f"{ld}" for ld in ds.lead_ID.values] #list of of all lead IDs for dataset
+    lead_weights = ac.scored_members(values)
     for bt in tqdm(range(bootstrap)):
         # screening phase (similar for all three allocation algorithms)
-        results_screening, lead_dict_screening = screening(ds,n_batch_start,replace=replace)
+        results_screening, lead_alloc_screening = screening(values,n_batch_start,replace=replace,rng=rng)
         # calculate scores
-        scores_screening = results_screening[0].values
+        scores_screening = results_screening[0][0]
+        top_screening = ac.merge_top(np.empty(0),np.empty(0,dtype=int),*results_screening[0],n_top)
         # find scores and chosen leads for different allocation types
-        alloc_types = ["Static","Weighted"]
+        alloc_types = ALLOC_TYPES
         score_info = []
         for alloc in alloc_types:
-            lead_dict= ac.find_alloc(alloc,ds.lead_ID,results_screening[0].sortby(results_screening[0],ascending=False),n_top,n_batch)
-            scores, lead_ID_all_rounds =  sample_score_alloc(ds,
-                                                           lead_dict,
+            lead_alloc = ac.find_alloc_array(alloc,*top_screening,n_top,n_batch,values.shape[0],weights=lead_weights,rng=rng)
+            scores, lead_alloc_all_rounds =  sample_score_alloc(values,
+                                                           lead_alloc,
                                                            results_screening,
                                                            n_top,
                                                            n_batch,
                                                            len_loop,
                                                            alloc_type=alloc,
-                                                           replace=replace)
-            #add screening scores to the beginning of list of scores per round
-            scores.insert(0,scores_screening)
-            lead_ID_all_rounds.insert(0,lead_dict_screening)
-            # information on which lead times were chosen
-            lead_data = np.zeros((len(lead_ID_all_rounds), len(lead_list)))
-            for i,round in enumerate(lead_ID_all_rounds):
-                for lead_ID in round:
-                    j = lead_list.index(lead_ID)
-                    lead_data[i,j] = round[lead_ID]
-            #make sure all arrays have same length
-            to_pad = np.max([len(sc) for sc in scores])
-            padded_score = [np.pad(arr, (0, to_pad - len(arr)), constant_values=np.nan) for arr in scores]
-            # store all info in dataset
-            score_info.append(xr.Dataset(
-                {
-                    "chosen_leads": (["round", "lead_ID"], lead_data),
-                    "score": (["round","distribution_value"], padded_score),
-                },
-                coords={
-                    "round": range(len(scores)),
-                    "lead_ID": lead_list,
-                    "distribution_value":range(to_pad)
-                },
-            ))
-        score_info_alloc_type = ut.concat_to_ds(score_info,"alloc_type",alloc_types)
-        score_info_boot.append(score_info_alloc_type)
-    score_info = xr.concat(score_info_boot,dim="bootstrap")
+                                                           replace=replace,
+                                                           rng=rng)
+            with tm.phase("dataset"):
+                #add screening scores to the beginning of list of scores per round
+                scores.insert(0,scores_screening)
+                lead_alloc_all_rounds.insert(0,lead_alloc_screening)
+                # information on which lead times were chosen
+                lead_data = np.stack(lead_alloc_all_rounds).astype(float)
+                #make sure all arrays have same length
+                to_pad = np.max([len(sc) for sc in scores])
+                padded_score = [np.pad(arr, (0, to_pad - len(arr)), constant_values=np.nan) for arr in scores]
+                # store all info in dataset
+                score_info.append(xr.Dataset(
+                    {
+                        "chosen_leads": (["round", "lead_ID"], lead_data),
+                        "score": (["round","distribution_value"], padded_score),
+                    },
+                    coords={
+                        "round": range(len(scores)),
+                        "lead_ID": lead_list,
+                        "distribution_value":range(to_pad)
+                    },
+                ))
+        with tm.phase("dataset"):
+            score_info_alloc_type = ut.concat_to_ds(score_info,"alloc_type",alloc_types)
+            score_info_boot.append(score_info_alloc_type)
+    with tm.phase("dataset"):
+        score_info = xr.concat(score_info_boot,dim="bootstrap")
+    with tm.phase("encode"):
+        return ss.encode_score_info(score_info,encoding,quantiles=quantiles,thresholds=thresholds)
+
+# === batched engine: all bootstrap replicates at once, on dense numpy arrays ===
+BATCH_CHUNK_ELEMENTS = 2**22 # max number of (replicate, lead_ID, member) elements held at once by the batched engine
+
+def _sample_batched(values,counts,perm=None,pos=None,drawable=None,rng=rng):
+    """Draws counts[b,l] members for each replicate b and lead code l, without replacement within the draw.
+        :param values: dense (lead_ID, member) array of scores, or (n_rep, lead_ID, member) with one array per replicate
+        :param counts: (n_rep, n_lead) number of new realizations to draw
+        :param perm: optional. (n_rep, n_lead, member) member permutations to take the draw from (no replacement between rounds), drawable members first. If None, a fresh permutation is drawn
+        :param pos: optional. (n_rep, n_lead) how many members of perm were already drawn. updated in place
+        :param drawable: optional. (n_rep, n_lead, member) mask of the members that exist (e.g. of the case of each replicate). If None, all members
+        returns [(n_rep, n_drawn) scores (NaN padded), (n_rep, n_drawn) lead codes]"""
+    with tm.phase("sampling",counts.sum):
+        n_rep, n_lead = counts.shape
+        n_mem = values.shape[-1]
+        n_drawable = n_mem if drawable is None else drawable.sum(axis=-1)
+        if perm is None:
+            counts = np.minimum(counts,n_drawable)
+        else:
+            counts = np.minimum(counts,n_drawable - pos)
+        reps, leads = np.nonzero(counts > 0)
+        width = counts.max() if len(reps) > 0 else 0
+        if width == 0:
+            return np.empty((n_rep,0)), np.zeros((n_rep,0),dtype=int)
+        pair_counts = counts[reps,leads]
+        if perm is None:
+            keys = rng.random((len(reps),n_mem))
+            if drawable is not None:
+                keys[~drawable[reps,leads]] = np.inf
+            members = keys.argsort(axis=-1)[:,:width]
+        else:
+            offsets = np.minimum(pos[reps,leads][:,None] + np.arange(width),n_mem-1)
+            members = perm[reps,leads][np.arange(len(reps))[:,None],offsets]
+            pos += counts
+        keep = np.arange(width) < pair_counts[:,None]
+        if values.ndim == 2:
+            drawn = values[leads[:,None],members][keep]
+        else:
+            drawn = values[reps[:,None],leads[:,None],members][keep]
+        drawn_codes = np.broadcast_to(leads[:,None],keep.shape)[keep]
+        drawn_reps = np.broadcast_to(reps[:,None],keep.shape)[keep]
+        # gather the draws of each replicate into one row
+        per_rep = counts.sum(axis=-1)
+        col = np.arange(len(drawn)) - np.repeat(np.cumsum(per_rep) - per_rep,per_rep)
+        scores = np.full((n_rep,per_rep.max()),np.nan)
+        score_codes = np.zeros((n_rep,per_rep.max()),dtype=int)
+        scores[drawn_reps,col] = drawn
+        score_codes[drawn_reps,col] = drawn_codes
+        return scores, score_codes
+
+def _compact(scores):
+    """moves the non-NaN scores of each row to the front and trims the all-NaN tail"""
+    order = np.argsort(np.isnan(scores),axis=-1,kind="stable")
+    scores = np.take_along_axis(scores,order,axis=-1)
+    return scores[:,:np.sum(~np.isnan(scores),axis=-1).max(initial=0)]
+
+def _pad_to(arr,length):
+    """NaN-pads the last axis of arr up to length"""
+    pad = [(0,0)]*(arr.ndim-1) + [(0,length-arr.shape[-1])]
+    return np.pad(arr,pad,constant_values=np.nan)
+
+def _screening_perm(n_rep,n_lead,n_mem,drawable=None,rng=rng):
+    """returns (n_rep, n_lead, n_mem) random member permutations, one per replicate and lead (drawable members first)"""
+    with tm.phase("permutation",n_rep*n_lead):
+        keys = rng.random((n_rep,n_lead,n_mem))
+        if drawable is None:
+            return keys.argsort(axis=-1)
+        return np.where(drawable,keys,np.inf).argsort(axis=-1)
+
+def _run_batched(values,n_top,n_batch,n_batch_start,len_loop,n_rep,alloc_types,replace=False,rng=rng,drawable=None,perm=None):
+    """Runs screening + len_loop allocation rounds for n_rep replicates at once on a dense (lead_ID, member) array, or on one (lead_ID, member) array per replicate ((n_rep, lead_ID, member), e.g. of different cases) with a drawable mask of their existing members.
+    perm (optional, see _screening_perm) gives the member permutations to draw from (e.g. shared by several grid cells), drawn from rng if None.
+        returns [(n_rep, alloc_type, round, distribution_value) scores, (n_rep, alloc_type, round, lead_ID) chosen leads]"""
+    n_lead, n_mem = values.shape[-2:]
+    if perm is None:
+        perm = _screening_perm(n_rep,n_lead,n_mem,drawable=drawable,rng=rng)
+    # screening: the first n_batch_start members of the permutation of each replicate and lead are drawn
+    with tm.phase("screening",n_rep*n_lead):
+        n_screen = min(n_batch_start,n_mem)
+        if drawable is None:
+            scores_screening = values[np.arange(n_lead)[:,None],perm[:,:,:n_screen]].reshape(n_rep,-1)
+            pos_screening = np.full((n_rep,n_lead),n_screen)
+        else:
+            pos_screening = np.minimum(n_screen,drawable.sum(axis=-1))
+            scores_screening = values[np.arange(n_rep)[:,None,None],np.arange(n_lead)[:,None],perm[:,:,:n_screen]]
+            scores_screening = np.where(np.arange(n_screen) < pos_screening[...,None],scores_screening,np.nan).reshape(n_rep,-1)
+        codes_screening = np.broadcast_to(np.repeat(np.arange(n_lead),n_screen),scores_screening.shape)
+        top_screening = ac.merge_top(np.full((n_rep,n_top),np.nan),np.zeros((n_rep,n_top),dtype=int),scores_screening,codes_screening,n_top)
+        leads_screening = np.full((n_rep,n_lead),n_batch_start)
+        lead_weights = ac.scored_members(values)
+        scores_screening = _compact(scores_screening)
+    scores_alloc = []
+    leads_alloc = []
+    for alloc in alloc_types:
+        top, top_codes = top_screening
+        pos = pos_screening.copy()
+        scores = [scores_screening]
+        leads = [leads_screening]
+        for i in range(len_loop):
+            #allocation from all events sampled so far, then sampling
+            lead_alloc = ac.find_alloc_batched(alloc,top,top_codes,n_top,n_batch,n_lead,weights=lead_weights,rng=rng)
+            if replace == True:
+                sampled, sampled_codes = _sample_batched(values,lead_alloc,drawable=drawable,rng=rng)
+            else:
+                sampled, sampled_codes = _sample_batched(values,lead_alloc,perm=perm,pos=pos,drawable=drawable,rng=rng)
+            top, top_codes = ac.merge_top(top,top_codes,sampled,sampled_codes,n_top)
+            scores.append(_compact(sampled))
+            leads.append(lead_alloc)
+        to_pad = max(sc.shape[-1] for sc in scores)
+        scores_alloc.append(np.stack([_pad_to(sc,to_pad) for sc in scores],axis=1))
+        leads_alloc.append(np.stack(leads,axis=1))
+    to_pad = max(sc.shape[-1] for sc in scores_alloc)
+    return np.stack([_pad_to(sc,to_pad) for sc in scores_alloc],axis=1), np.stack(leads_alloc,axis=1)
+
+def score_algo_batched(ds,n_top,n_batch,n_batch_start,len_loop,bootstrap,replace=False,rng=rng,encoding="dense",quantiles=(0.5,0.9,0.99),thresholds=None,perm_rng=None):
+    """Runs the screening + allocation algorithm for set parameters, for all bootstrap replicates at once on dense numpy arrays. Gives the same dataset layout as score_algo.
+        :param ds: dataset that contains boosted events with dimensions lead_ID (either just lead time or stacked lead_time and case). With a case dimension too, each case is run separately (see _batched)
+        :param n_top: values of n_top (length of top events to use for allocation)
+        :param n_batch: value of n_batch (batch size for each allocation round)
+        :param n_batch_start: value of n_batch_start (batch size for screening round)
+        :param len_loop: how many rounds of allocation to perform
+        :param bootstrap: how many times are you bootstrapping the process
+        :param replace: whether or not to replace event when randomly sampled
+        :param rng: optional. numpy random generator to draw from
+        :param encoding: optional. "dense" (scores NaN padded over distribution_value), "ragged" (scores with offsets) or "summary" (per round statistics only), see sweep_store.encode_score_info
+        :param quantiles: optional. quantiles of the scores of each round kept with encoding "summary"
+        :param thresholds: optional. thresholds to count exceedances of with encoding "summary"
+        :param perm_rng: optional. numpy random generator of the member permutations only, e.g. seeded the same for all grid cells of one n_batch_start (common random numbers, see _batched). If None, rng
+        returns the resulting dataset (over case, bootstrap, ... with a case dimension)"""
+    score_info = _batched(ds,n_top,n_batch,n_batch_start,len_loop,bootstrap,replace=replace,rng=rng,perm_rng=perm_rng)
+    with tm.phase("encode"):
+        return ss.encode_score_info(score_info,encoding,quantiles=quantiles,thresholds=thresholds)
+
+def _case_masks(values):
+    """returns the masks of the lead_IDs (case, lead_ID) and of the members (case, lead_ID, member) of each case that have any score, from (case, lead_ID, member) values"""
+    scored = ~np.isnan(values)
+    valid_lead = scored.any(axis=-1)
+    return valid_lead, valid_lead[:,:,None] & scored.any(axis=-2)[:,None,:]
+
+def _batched(ds,n_top,n_batch,n_batch_start,len_loop,bootstrap,replace=False,rng=rng,perm_rng=None):
+    """Runs the replicates of score_algo_batched with _run_batched, in chunks so the member permutations in memory are bounded.
+    With a case dimension, the algorithm is run separately on each case, with the replicates of all cases batched together. Each case only draws from its own lead_IDs and members with any score (like dropping the all-NaN ones of the case), through masks, so cases with different lead_IDs and members share one dense array. chosen_leads is NaN for the lead_IDs a case does not have.
+    With perm_rng, the member permutations of each chunk are drawn from it, and only depend on its seed and the size of the data: grid cells given the same seed screen the same members, and without replacement take the following members of each lead_ID prefix by prefix (common random numbers).
+        returns the score_info dataset (not encoded)"""
+    alloc_types = ALLOC_TYPES
+    lead_list = [f"{ld}" for ld in ds.lead_ID.values] #list of of all lead IDs for dataset
+    if "case" in ds.dims:
+        values = ds.transpose("case","lead_ID","member").values.astype(float)
+        valid_lead, drawable = _case_masks(values)
+        rep_case = np.repeat(np.arange(values.shape[0]),bootstrap)
+        cases = [f"{case}" for case in ds.case.values]
+    else:
+        values = ds.transpose("lead_ID","member").values.astype(float)
+        rep_case = np.zeros(bootstrap,dtype=int)
+        cases = None
+    n_lead, n_mem = values.shape[-2:]
+    chunk = max(1,BATCH_CHUNK_ELEMENTS//(n_lead*n_mem))
+    scores = []
+    leads = []
+    for start in tqdm(range(0,len(rep_case),chunk)):
+        reps = rep_case[start:start+chunk]
+        chunk_values = values if cases is None else values[reps]
+        chunk_drawable = None if cases is None else drawable[reps]
+        perm = None if perm_rng is None else _screening_perm(len(reps),n_lead,n_mem,drawable=chunk_drawable,rng=perm_rng)
+        sc, ld = _run_batched(chunk_values,n_top,n_batch,n_batch_start,len_loop,len(reps),alloc_types,replace=replace,rng=rng,drawable=chunk_drawable,perm=perm)
+        scores.append(sc)
+        leads.append(ld if cases is None else np.where(valid_lead[reps][:,None,None,:],ld,np.nan))
+    return _batched_dataset(scores,leads,lead_list,alloc_types,len_loop,cases=cases)
+
+def _batched_dataset(scores,leads,lead_list,alloc_types,len_loop,cases=None):
+    """builds the score_info dataset from the lists of (scores, chosen leads) of chunks of replicates run by _run_batched. 
+    With cases, the replicates are those of each case one after the other, and are split over dimensions (case, bootstrap)"""
+    with tm.phase("dataset"):
+        to_pad = max(sc.shape[-1] for sc in scores)
+        scores = np.concatenate([_pad_to(sc,to_pad) for sc in scores],axis=0)
+        leads = np.concatenate(leads,axis=0).astype(float)
+        dims = ["bootstrap"]
+        coords = {}
+        if cases is not None:
+            scores = scores.reshape((len(cases),-1) + scores.shape[1:])
+            leads = leads.reshape((len(cases),-1) + leads.shape[1:])
+            dims = ["case","bootstrap"]
+            coords = {"case": cases}
+        return xr.Dataset(
+            {
+                "chosen_leads": (dims+["alloc_type","round","lead_ID"], leads),
+                "score": (dims+["alloc_type","round","distribution_value"], scores),
+            },
+            coords=dict(coords,
+                alloc_type=alloc_types,
+                round=range(len_loop+1),
+                lead_ID=lead_list,
+                distribution_value=range(to_pad),
+            ),
+        )
+
+# === adaptive bootstrap: replicates in blocks until the Monte Carlo error of the results is small enough ===
+
+def round_max(scores):
+    """returns the maximum score of each round (NaN for rounds without scores) from (..., distribution_value) NaN padded scores"""
+    has_score = np.any(~np.isnan(scores),axis=-1)
+    return np.where(has_score,np.max(np.where(np.isnan(scores),-np.inf,scores),axis=-1,initial=-np.inf),np.nan)
+
+def mc_standard_errors(top,thresholds=None):
+    """Monte Carlo standard errors of the bootstrap estimates of the mean top score and of the probability of the top score exceeding each threshold.
+        :param top: (bootstrap, ...) top score of each replicate (NaN where there is none)
+        :param thresholds: optional. list of thresholds
+        returns [(...) standard error of the mean top score (NaN with less than 2 replicates with a top score), (..., threshold) standard error of the exceedance probabilities (None without thresholds)]"""
+    n_valid = np.sum(~np.isnan(top),axis=0)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        mean = np.nansum(top,axis=0) / n_valid
+        var = np.nansum((top - mean)**2,axis=0) / (n_valid - 1)
+        top_se = np.where(n_valid > 1,np.sqrt(var / n_valid),np.nan)
+    if thresholds is None or len(thresholds) == 0:
+        return top_se, None
+    prob = np.mean(top[...,None] > np.asarray(thresholds),axis=0)
+    return top_se, np.sqrt(prob*(1-prob) / top.shape[0])
+
+def score_algo_adaptive(ds,n_top,n_batch,n_batch_start,len_loop,bootstrap,replace=False,rng=rng,encoding="dense",quantiles=(0.5,0.9,0.99),thresholds=None,block=50,min_bootstrap=100,target_se=0.05,target_prob_se=0.02):
+    """Runs the screening + allocation algorithm like score_algo_batched, but in blocks of replicates, stopping as soon as the Monte Carlo standard error of the mean top score of each round (and of the probability of exceeding each threshold) is below target, or after bootstrap replicates.
+        :param ds: dataset that contains boosted events with dimensions lead_ID (either just lead time or stacked lead_time and case)
+        :param n_top: values of n_top (length of top events to use for allocation)
+        :param n_batch: value of n_batch (batch size for each allocation round)
+        :param n_batch_start: value of n_batch_start (batch size for screening round)
+        :param len_loop: how many rounds of allocation to perform
+        :param bootstrap: maximum number of replicates
+        :param replace: whether or not to replace event when randomly sampled
+        :param rng: optional. numpy random generator to draw from
+        :param encoding: optional. "dense", "ragged" or "summary", see sweep_store.encode_score_info
+        :param quantiles: optional. quantiles of the scores of each round kept with encoding "summary"
+        :param thresholds: optional. thresholds of the exceedance probabilities to monitor (and to count exceedances of with encoding "summary")
+        :param block: optional. number of replicates run between convergence checks
+        :param min_bootstrap: optional. minimum number of replicates before stopping
+        :param target_se: optional. target standard error of the mean top score of each round (in score units)
+        :param target_prob_se: optional. target standard error of the exceedance probabilities
+        returns the resulting dataset, with the number of replicates run (n_bootstrap) and the final standard errors (top_score_se, exceedance_se)"""
+    values = ds.transpose("lead_ID","member").values.astype(float)
+    lead_list = [f"{ld}" for ld in ds.lead_ID.values] #list of of all lead IDs for dataset
+    alloc_types = ALLOC_TYPES
+    chunk = max(1,BATCH_CHUNK_ELEMENTS//values.size)
+    scores = []
+    leads = []
+    tops = []
+    n_done = 0
+    with tqdm(total=bootstrap) as progress:
+        while n_done < bootstrap:
+            n_rep = min(block,bootstrap-n_done)
+            for start in range(0,n_rep,chunk):
+                sc, ld = _run_batched(values,n_top,n_batch,n_batch_start,len_loop,min(chunk,n_rep-start),alloc_types,replace=replace,rng=rng)
+                scores.append(sc)
+                leads.append(ld)
+                tops.append(round_max(sc))
+            n_done += n_rep
+            progress.update(n_rep)
+            with tm.phase("convergence"):
+                top = np.concatenate(tops)
+                top_se, exceedance_se = mc_standard_errors(top,thresholds)
+                # rounds that never have a score have nothing to converge
+                converged = np.all((top_se <= target_se) | np.all(np.isnan(top),axis=0))
+                if exceedance_se is not None:
+                    converged = converged and np.all(exceedance_se <= target_prob_se)
+            if n_done >= min_bootstrap and converged:
+                break
+    score_info = _batched_dataset(scores,leads,lead_list,alloc_types,len_loop)
+    with tm.phase("encode"):
+        score_info = ss.encode_score_info(score_info,encoding,quantiles=quantiles,thresholds=thresholds)
+    # indexed, so cells that ran different numbers of replicates can be concatenated (NaN padded)
+    score_info = score_info.assign_coords(bootstrap=range(n_done))
+    score_info["n_bootstrap"] = n_done
+    score_info["top_score_se"] = (["alloc_type","round"], top_se)
+    if exceedance_se is not None:
+        score_info["exceedance_se"] = (["alloc_type","round","threshold"], exceedance_se)
+        score_info = score_info.assign_coords(threshold=list(thresholds))
     return score_info
 
-def score_diff_config(ds,n_tops,n_batchs,n_batch_starts,len_loop,bootstrap,save_info,replace=True):
-    """Runs the screening + allocation algorithm for a range of parameters, in a bootstrapped way. saves results as .nc file in folder outputs. 
+_worker_ds = None # dataset of a sweep worker process, set once by _init_worker
+OUTPUT_PATH = "/net/xenon/climphys/lbloin/optim_boost/" # default folder of sweep outputs
+
+def _init_worker(ds):
+    """stores the dataset in a sweep worker process, so it is only sent once per worker"""
+    global _worker_ds
+    _worker_ds = ds
+
+def _score_cell(algo,cell,len_loop,bootstrap,seed,store,ds=None,timed=False,perm_seed=None,**kwargs):
+    """runs algo for one (n_batch_start, n_batch, n_top) grid cell, with its own random generator seeded by the SeedSequence seed, and writes the result to the sweep store. 
+    With perm_seed (SeedSequence of the row, see sweep_rows), the member permutations are drawn from their own generator seeded by it (common random numbers, see score_algo_batched).
+    If timed, the phase timings of the cell are saved next to it (see timing). kwargs are passed on to algo. returns the cell"""
+    if perm_seed is not None:
+        kwargs["perm_rng"] = default_rng(perm_seed)
+    if ds is None:
+        ds = _worker_ds
+    n_batch_start, n_batch, n_top = cell
+    with tm.recording() if timed else contextlib.nullcontext():
+        with tm.phase("cell"):
+            score_info = algo(ds,n_top,n_batch,n_batch_start,len_loop,bootstrap,rng=default_rng(seed),**kwargs)
+            with tm.phase("write_cell"):
+                ss.write_cell(store,cell,score_info)
+        if timed:
+            tm.save_json(tm.stats(),ss.timing_path(store,cell))
+    return cell
+
+def sweep_rows(n_batch_starts,seed_seq,key=()):
+    """Gives the random stream of the member permutations shared by the grid cells of each n_batch_start in common random numbers mode (see score_algo_batched), keyed by n_batch_start (and key, e.g. a stage) so it is the same whatever the rest of the grid.
+        :param seed_seq: root SeedSequence of the sweep (see sweep_cells)
+        returns dict of {n_batch_start: SeedSequence}"""
+    return {n_batch_start: np.random.SeedSequence(seed_seq.entropy,spawn_key=seed_seq.spawn_key+(n_batch_start,)+tuple(key)) for n_batch_start in n_batch_starts}
+
+def sweep_cells(n_tops,n_batchs,n_batch_starts,seed=None):
+    """Lists the grid cells of a parameter sweep, each with its own random stream. The stream of a cell is keyed by its (n_batch_start, n_batch, n_top), so a cell always gets the same stream for a given seed, whatever the rest of the grid.
+        :param n_tops: list of values of n_top (length of top events to use for allocation)
+        :param n_batchs: list of values of n_batch (batch size for each allocation round)
+        :param n_batch_starts: list of values of n_batch_start (batch size for screening round)
+        :param seed: optional. seed (or SeedSequence) of the sweep. If None, fresh entropy is used
+        returns [list of ((n_batch_start, n_batch, n_top), SeedSequence), root SeedSequence]"""
+    seed_seq = seed if isinstance(seed,np.random.SeedSequence) else np.random.SeedSequence(seed)
+    cells = []
+    for n_batch_start in n_batch_starts:
+        for n_batch in n_batchs:
+            for n_top in n_tops:
+                if n_top > n_batch:
+                    break
+                cell_seed = np.random.SeedSequence(seed_seq.entropy,spawn_key=seed_seq.spawn_key+(n_batch_start,n_batch,n_top))
+                cells.append(((n_batch_start,n_batch,n_top), cell_seed))
+    return cells, seed_seq
+
+def gather_cells(results,n_tops,n_batchs,n_batch_starts):
+    """concatenates a dict of {(n_batch_start, n_batch, n_top): score_info} into one dataset over start_batch_size, batch_size and top_length. 
+    Cells may differ in their other coordinates (e.g. round, or bootstrap with the halving): they are outer joined, missing values being NaN"""
+    join = dict(join="outer",fill_value=np.nan)
+    score_info_batch_start = []
+    for n_batch_start in n_batch_starts:
+        scores_batch = []
+        for n_batch in n_batchs:
+            n_top_used = [n_top for n_top in n_tops if (n_batch_start,n_batch,n_top) in results]
+            scores_batch.append(ut.concat_to_ds([results[(n_batch_start,n_batch,n_top)] for n_top in n_top_used],"top_length",n_top_used,**join))
+        score_info_batch_start.append(ut.concat_to_ds(scores_batch,"batch_size",n_batchs,**join))
+    return ut.concat_to_ds(score_info_batch_start,"start_batch_size",n_batch_starts,**join)
+
+def _engine(engine):
+    """returns the scoring function of an engine ("batched", "adaptive" or "loop")"""
+    if engine == "batched":
+        return score_algo_batched
+    elif engine == "adaptive":
+        return score_algo_adaptive
+    elif engine == "loop":
+        return score_algo
+    else:
+        raise ValueError(f"engine should be 'batched', 'adaptive' or 'loop', not {engine}")
+
+def dask_client(address=None,n_workers=None):
+    """Connects to a dask.distributed scheduler to run sweep grid cells on (see run_cells). The workers need the utils folder on their PYTHONPATH and the store folder on a shared file system.
+        :param address: optional. address of a running scheduler (e.g. "tcp://node:8786"). If None, a LocalCluster is started
+        :param n_workers: optional. number of worker processes of the LocalCluster, single-threaded so the phase timings of a worker are those of one cell
+        returns the Client"""
+    import dask
+    from distributed import Client, LocalCluster
+    if address is not None:
+        return Client(address)
+    # fork (where available) so the workers don't re-run the calling script
+    method = "fork" if "fork" in mp.get_all_start_methods() else "spawn"
+    with dask.config.set({"distributed.worker.multiprocessing-method": method}):
+        return Client(LocalCluster(n_workers=n_workers,threads_per_worker=1))
+
+def run_cells(ds,algo,cells,len_loop,bootstrap,store,manifest,n_workers=1,timed=False,client=None,retries=2,row_seeds=None,**kwargs):
+    """Runs algo for the grid cells of a sweep that are not done yet in the store, and marks them done in the manifest as they finish.
+        :param ds: dataset that contains boosted events with dimensions lead_ID
+        :param algo: scoring function (e.g. score_algo_batched)
+        :param cells: list of ((n_batch_start, n_batch, n_top), SeedSequence) (see sweep_cells)
+        :param len_loop: how many rounds of allocation to perform
+        :param bootstrap: how many times are you bootstrapping the process
+        :param store: folder of the sweep store
+        :param manifest: manifest of the store (see sweep_store.open_manifest)
+        :param n_workers: optional. number of processes to run grid cells on
+        :param timed: optional. whether to save the phase timings of each cell
+        :param client: optional. dask.distributed Client to run the grid cells on instead of local processes (see dask_client)
+        :param retries: optional. how many times a grid cell that failed on the client (e.g. a lost worker) is run again
+        :param row_seeds: optional. dict of {n_batch_start: SeedSequence} (see sweep_rows). If given, the member permutations of each cell are drawn from the stream of its n_batch_start (common random numbers, see score_algo_batched)
+        :param kwargs: passed on to algo
+        returns None"""
+    to_run = [(cell,cell_seed) for cell, cell_seed in cells if not ss.is_done(store,manifest,cell)]
+    print(f"{len(cells)-len(to_run)} of {len(cells)} grid cells already done")
+    if row_seeds is None:
+        row_seeds = {}
+    if client is not None:
+        from distributed import as_completed as dask_completed
+        # the dataset is sent once to every worker, each task writes its cell to the store
+        ds_future = client.scatter(ds,broadcast=True)
+        task = partial(_score_cell,algo,timed=timed,**kwargs)
+        futures = {client.submit(task,cell,len_loop,bootstrap,cell_seed,store,ds=ds_future,perm_seed=row_seeds.get(cell[0]),retries=retries,pure=False): cell for cell, cell_seed in to_run}
+        failed = []
+        for future in dask_completed(futures):
+            cell = futures[future]
+            if future.status == "error":
+                print(f"failed: batch size for screening = {cell[0]}, batch size {cell[1]}, allocation length {cell[2]}: {future.exception()!r}")
+                failed.append(cell)
+                continue
+            ss.mark_done(store,manifest,future.result())
+            print(f"done: batch size for screening = {cell[0]}, batch size {cell[1]}, allocation length {cell[2]}")
+        if len(failed) > 0:
+            raise RuntimeError(f"{len(failed)} grid cells failed after {retries} retries: {failed}. running the sweep again only runs these")
+    elif n_workers == 1:
+        for cell, cell_seed in to_run:
+            print(f"Batch size for screening = {cell[0]}, batch size {cell[1]}, allocation length {cell[2]}")
+            ss.mark_done(store,manifest,_score_cell(algo,cell,len_loop,bootstrap,cell_seed,store,ds=ds,timed=timed,perm_seed=row_seeds.get(cell[0]),**kwargs))
+    else:
+        # fork (where available) so the workers don't re-run the calling script
+        context = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=n_workers,mp_context=context,initializer=_init_worker,initargs=(ds,)) as pool:
+            futures = [pool.submit(_score_cell,algo,cell,len_loop,bootstrap,cell_seed,store,timed=timed,perm_seed=row_seeds.get(cell[0]),**kwargs) for cell, cell_seed in to_run]
+            for future in as_completed(futures):
+                cell = future.result()
+                ss.mark_done(store,manifest,cell)
+                print(f"done: batch size for screening = {cell[0]}, batch size {cell[1]}, allocation length {cell[2]}")
+
+def score_diff_config(ds,n_tops,n_batchs,n_batch_starts,len_loop,bootstrap,save_info,replace=True,engine="batched",n_workers=1,seed=None,output_path=OUTPUT_PATH,encoding="dense",quantiles=(0.5,0.9,0.99),thresholds=None,timed=False,adaptive=None,client=None,retries=2,common=False):
+    """Runs the screening + allocation algorithm for a range of parameters, in a bootstrapped way. saves results as .nc file in folder output_path. 
+        Each finished grid cell is written to the store folder score_info_{save_info}/ (see sweep_store), so a restarted sweep skips the cells already done and memory is bounded by one cell.
+        Each grid cell draws from its own random stream derived from seed, so results are identical for any n_workers.
         :param ds: dataset that contains boosted events with dimensions lead_ID (either just lead time or stacked lead_time and case)
         :param n_tops: list of values of n_top (length of top events to use for allocation
         :param n_batchs: list of values of n_batch (batch size for each allocation round)
         :param n_batch_starts: list of values of n_batch_start (batch size for screening round)
         :param len_loop: how many rounds of allocation to perform
-        :param bootstrap: how many times are you bootstrapping the process
+        :param bootstrap: how many times are you bootstrapping the process (the maximum with engine "adaptive")
         :param save_info: what to save results .nc file
         :param replace: whether or not to replace event when randomly sampled
+        :param engine: "batched" (all bootstrap replicates at once, see score_algo_batched), "adaptive" (blocks of replicates until converged, see score_algo_adaptive) or "loop" (one replicate at a time, see score_algo)
+        :param n_workers: optional. number of processes to run grid cells on
+        :param seed: optional. seed of the sweep (saved in the attributes of the output). If None, the seed of an unfinished sweep with the same save_info, or fresh entropy
+        :param output_path: optional. folder to save the results in
+        :param encoding: optional. "dense" (scores NaN padded over distribution_value), "ragged" (scores with offsets) or "summary" (per round statistics only), see sweep_store.encode_score_info
+        :param quantiles: optional. quantiles of the scores of each round kept with encoding "summary"
+        :param thresholds: optional. thresholds to count exceedances of with encoding "summary"
+        :param adaptive: optional. dict of stopping settings of engine "adaptive" (block, min_bootstrap, target_se, target_prob_se), default those of score_algo_adaptive
+        :param timed: optional. whether to record the time, calls and items of each phase of each grid cell (see timing), saved as score_info_{save_info}_timing.json next to the results
+        :param client: optional. dask.distributed Client to run the grid cells on (e.g. a multi-node scheduler, see dask_client), instead of n_workers local processes
+        :param retries: optional. how many times a grid cell that failed on the client is run again
+        :param common: optional. whether the grid cells of each n_batch_start draw the same member permutations (same screening for all n_batch and n_top, common random numbers, see score_algo_batched), only with engine "batched"
         returns None"""
-    score_info_batch_start = [] 
-    # varying batch size for screening phase
-    for n_batch_start in n_batch_starts:
-        print(f"Batch size for screening = {n_batch_start}")
-        # varying batch size (for each top performing event, how many new events to sample)
-        scores_batch = []
-        for n_batch in n_batchs:
-            print(f"Batch size {n_batch}")
-            # varying n_top (how many top performing events will be used for allocation in next round)
-            score_info_n_top = []
-            n_top_used = []
-            for n_top in n_tops:
-                if n_top > n_batch:
-                    break
-                print(f"Allocation length {n_top}")
-                n_top_used.append(n_top)
-                #calculating aggregated scores for all three allocation types
-                score_info = score_algo(ds,
-                                   n_top,
-                                   n_batch,
-                                   n_batch_start,     
-                                   len_loop,
-                                   bootstrap,
-                                   replace = replace
-                                   )
-                score_info_n_top.append(score_info)
-            scores_batch.append(ut.concat_to_ds(score_info_n_top,"top_length",n_top_used))
-        score_info_batch_start.append(ut.concat_to_ds(scores_batch,"batch_size",n_batchs))
-    score_info = ut.concat_to_ds(score_info_batch_start,"start_batch_size",n_batch_starts)
-    score_info.to_netcdf(f"/net/xenon/climphys/lbloin/optim_boost/score_info_{save_info}.nc")
-    return None
\ No newline at end of file
+    algo = _engine(engine)
+    if "case" in ds.dims and engine != "batched":
+        raise ValueError(f"a dataset with a case dimension is only run by engine 'batched', not {engine}")
+    if common and engine != "batched":
+        raise ValueError(f"common random numbers are only run by engine 'batched', not {engine}")
+    store = f"{output_path}score_info_{save_info}/"
+    algo_kwargs = {"replace":replace,"encoding":encoding,"quantiles":list(quantiles),"thresholds":None if thresholds is None else list(thresholds)}
+    if engine == "adaptive" and adaptive is not None:
+        algo_kwargs.update(adaptive)
+    config = dict(algo_kwargs,len_loop=len_loop,bootstrap=bootstrap,engine=engine)
+    if common:
+        config["common"] = True
+    manifest = ss.open_manifest(store,config,seed=seed)
+    cells, seed_seq = sweep_cells(n_tops,n_batchs,n_batch_starts,seed=int(manifest["seed"]))
+    row_seeds = sweep_rows(n_batch_starts,seed_seq) if common else None
+    run_cells(ds,algo,cells,len_loop,bootstrap,store,manifest,n_workers=n_workers,timed=timed,client=client,retries=retries,row_seeds=row_seeds,**algo_kwargs)
+    # gather all cells lazily, so writing the full output streams one cell at a time
+    score_info = gather_cells(ss.open_cells(store,[cell for cell, cell_seed in cells]),n_tops,n_batchs,n_batch_starts)
+    # integer variables of cells are float after gathering (NaN where n_top > n_batch), so the cells' on-disk dtypes are dropped
+    score_info = score_info.drop_encoding()
+    score_info.attrs["seed"] = manifest["seed"]
+    score_info.to_netcdf(f"{output_path}score_info_{save_info}.nc",encoding=ss.count_encoding(score_info))
+    if timed:
+        cell_stats = ss.open_timings(store,[cell for cell, cell_seed in cells])
+        tm.save_json({"cells": cell_stats, "total": tm.total(cell_stats.values())},f"{output_path}score_info_{save_info}_timing.json")
+    return None
+# === successive halving: prune the grid on a few replicates, spend more replicates on the best cells ===
+
+def cell_round_max(score_info):
+    """returns the maximum score of each (bootstrap, alloc_type, round) of one grid cell, for any encoding (see sweep_store.encode_score_info)"""
+    encoding = score_info.attrs.get("encoding","dense")
+    if encoding == "summary":
+        return score_info.score_max
+    return ss.decode_score_info(score_info).score.max("distribution_value")
+
+def cell_metric(score_info,metric="mean_max",alloc_type="Weighted",threshold=None):
+    """Returns the value of metric for each bootstrap replicate of one grid cell (higher is better).
+        :param metric: "mean_max" (highest score found over all rounds) or "exceedance" (whether a score above threshold was found), or a function of the (bootstrap, alloc_type, round) maximum scores returning a DataArray over bootstrap
+        :param alloc_type: optional. allocation type to rank cells by
+        :param threshold: optional. threshold of metric "exceedance"
+        returns DataArray over bootstrap"""
+    round_max = cell_round_max(score_info)
+    if callable(metric):
+        return metric(round_max)
+    best = round_max.sel(alloc_type=alloc_type).max("round")
+    if metric == "mean_max":
+        return best
+    elif metric == "exceedance":
+        return (best > threshold).astype(float).where(best.notnull())
+    else:
+        raise ValueError(f"metric should be 'mean_max', 'exceedance' or a function, not {metric}")
+
+def halving_stages(min_bootstrap,max_bootstrap,eta=2):
+    """returns the number of replicates of each successive halving stage: min_bootstrap, multiplied by eta at each stage, up to max_bootstrap"""
+    if eta <= 1:
+        raise ValueError(f"eta should be above 1, not {eta}")
+    if min_bootstrap <= 0:
+        raise ValueError(f"min_bootstrap should be positive, not {min_bootstrap}")
+    stages = [min_bootstrap]
+    while stages[-1] < max_bootstrap:
+        stages.append(min(stages[-1]*eta,max_bootstrap))
+    return stages
+
+def prune(means,ses,eta=2,z=2.):
+    """Selects the cells to keep for the next stage: the best 1/eta of the cells by mean, and the cells that are not clearly worse than the last of them (mean + z*se above its mean - z*se).
+        :param means: dict of {cell: mean metric}
+        :param ses: dict of {cell: standard error of the mean metric}
+        :param eta: optional. fraction of cells to keep is 1/eta
+        :param z: optional. number of standard errors a cell has to be below the cut to be dropped. If None, or if the standard error of the cut is unknown (infinite), exactly the best 1/eta are kept
+        returns list of kept cells, best first"""
+    ranked = sorted(means,key=lambda cell: -np.nan_to_num(means[cell],nan=-np.inf))
+    n_keep = max(1,int(np.ceil(len(ranked)/eta)))
+    cut = ranked[n_keep-1]
+    if z is None or not np.isfinite(ses[cut]):
+        return ranked[:n_keep]
+    bound = means[cut] - z*ses[cut]
+    return ranked[:n_keep] + [cell for cell in ranked[n_keep:] if means[cell] + z*ses[cell] >= bound]
+
+def score_halving(ds,n_tops,n_batchs,n_batch_starts,len_loop,save_info,min_bootstrap=50,max_bootstrap=800,eta=2,metric="mean_max",alloc_type="Weighted",threshold=None,z=2.,replace=True,engine="batched",n_workers=1,seed=None,output_path=OUTPUT_PATH,encoding="dense",quantiles=(0.5,0.9,0.99),thresholds=None,timed=False,client=None,retries=2,common=False):
+    """Searches the best parameters by successive halving: all grid cells are run with min_bootstrap replicates, the cells clearly worse by metric are pruned (see prune), and the others are run again with eta times more replicates, until max_bootstrap.
+        Each stage is a resumable sweep store score_info_{save_info}/stage{i}/. The output (saved as score_info_{save_info}.nc) holds each cell as run at the last stage it reached.
+        :param ds: dataset that contains boosted events with dimensions lead_ID (either just lead time or stacked lead_time and case)
+        :param n_tops: list of values of n_top (length of top events to use for allocation
+        :param n_batchs: list of values of n_batch (batch size for each allocation round)
+        :param n_batch_starts: list of values of n_batch_start (batch size for screening round)
+        :param len_loop: how many rounds of allocation to perform
+        :param save_info: what to save results .nc file
+        :param min_bootstrap: optional. number of replicates of the first stage
+        :param max_bootstrap: optional. number of replicates of the last stage
+        :param eta: optional. the best 1/eta of the cells are kept at each stage, with eta times more replicates
+        :param metric: optional. metric to rank cells by (see cell_metric), higher is better
+        :param alloc_type: optional. allocation type to rank cells by
+        :param threshold: optional. threshold of metric "exceedance"
+        :param z: optional. cells within z standard errors of the cut are kept too (None to keep exactly 1/eta)
+        other parameters as in score_diff_config
+        returns None"""
+    algo = _engine(engine)
+    if common and engine != "batched":
+        raise ValueError(f"common random numbers are only run by engine 'batched', not {engine}")
+    if metric == "exceedance" and threshold is None:
+        raise ValueError("metric 'exceedance' needs a threshold")
+    algo_kwargs = {"replace":replace,"encoding":encoding,"quantiles":list(quantiles),"thresholds":None if thresholds is None else list(thresholds)}
+    stages = halving_stages(min_bootstrap,max_bootstrap,eta)
+    config = dict(algo_kwargs,len_loop=len_loop,engine=engine,stages=stages,eta=eta,metric=metric if isinstance(metric,str) else "custom",alloc_type=alloc_type,threshold=threshold,z=z)
+    if common:
+        config["common"] = True
+    sweep = f"{output_path}score_info_{save_info}/"
+    manifest = ss.open_manifest(sweep,config,seed=seed)
+    cells, seed_seq = sweep_cells(n_tops,n_batchs,n_batch_starts,seed=int(manifest["seed"]))
+    cell_seeds = dict(cells)
+    alive = list(cell_seeds)
+    last_stage = {}
+    means = np.full((len(stages),len(cell_seeds)),np.nan)
+    ses = np.full((len(stages),len(cell_seeds)),np.nan)
+    position = {cell: i for i,cell in enumerate(cell_seeds)}
+    for stage, bootstrap in enumerate(stages):
+        print(f"stage {stage}: {len(alive)} grid cells, {bootstrap} replicates")
+        store = f"{sweep}stage{stage}/"
+        stage_manifest = ss.open_manifest(store,dict(config,bootstrap=bootstrap),seed=manifest["seed"])
+        # replicates of each stage are independent of the previous stages
+        stage_cells = [(cell,np.random.SeedSequence(cell_seeds[cell].entropy,spawn_key=cell_seeds[cell].spawn_key+(stage,))) for cell in alive]
+        row_seeds = sweep_rows(n_batch_starts,seed_seq,key=(stage,)) if common else None
+        run_cells(ds,algo,stage_cells,len_loop,bootstrap,store,stage_manifest,n_workers=n_workers,timed=timed,client=client,retries=retries,row_seeds=row_seeds,**algo_kwargs)
+        stage_means = {}
+        stage_ses = {}
+        for cell, score_info in ss.open_cells(store,alive).items():
+            values = cell_metric(score_info,metric,alloc_type=alloc_type,threshold=threshold).values
+            n_valid = np.sum(~np.isnan(values))
+            stage_means[cell] = np.nanmean(values) if n_valid > 0 else np.nan
+            stage_ses[cell] = np.nanstd(values,ddof=1)/np.sqrt(n_valid) if n_valid > 1 else np.inf
+            means[stage,position[cell]] = stage_means[cell]
+            ses[stage,position[cell]] = stage_ses[cell]
+            last_stage[cell] = stage
+        if stage < len(stages) - 1:
+            alive = prune(stage_means,stage_ses,eta=eta,z=z)
+    # each cell as run at the last stage it reached, so with different numbers of replicates (outer joined over bootstrap by gather_cells)
+    results = {}
+    for cell in cell_seeds:
+        score_info = ss.open_cells(f"{sweep}stage{last_stage[cell]}/",[cell])[cell]
+        results[cell] = score_info.assign_coords(bootstrap=range(score_info.sizes["bootstrap"]))
+    score_info = gather_cells(results,n_tops,n_batchs,n_batch_starts).drop_encoding()
+    # pruning information per cell
+    grid = {"start_batch_size": n_batch_starts, "batch_size": n_batchs, "top_length": n_tops}
+    pruning = {
+        "last_stage": np.full([len(v) for v in grid.values()],np.nan),
+        "stage_metric": np.full([len(v) for v in grid.values()]+[len(stages)],np.nan),
+        "stage_metric_se": np.full([len(v) for v in grid.values()]+[len(stages)],np.nan),
+    }
+    for cell in cell_seeds:
+        n_batch_start, n_batch, n_top = cell
+        index = (n_batch_starts.index(n_batch_start),n_batchs.index(n_batch),n_tops.index(n_top))
+        pruning["last_stage"][index] = last_stage[cell]
+        pruning["stage_metric"][index] = means[:,position[cell]]
+        pruning["stage_metric_se"][index] = ses[:,position[cell]]
+    score_info["last_stage"] = (list(grid), pruning["last_stage"])
+    score_info["stage_metric"] = (list(grid)+["stage"], pruning["stage_metric"])
+    score_info["stage_metric_se"] = (list(grid)+["stage"], pruning["stage_metric_se"])
+    score_info = score_info.assign_coords(stage_bootstrap=("stage",stages))
+    score_info["pruned"] = score_info.last_stage < len(stages) - 1
+    score_info.attrs["seed"] = manifest["seed"]
+    score_info.attrs["metric"] = config["metric"]
+    score_info.to_netcdf(f"{output_path}score_info_{save_info}.nc",encoding=ss.count_encoding(score_info))
+    return None
@@ -0,0 +1,61 @@
+import os
+import xarray as xr
+import utils as ut
+
+# === Cache of climatology statistics ===
+# The climatology file TREFHTMX_{area}_{period}.nc holds the full unperturbed ensemble, so its day of year mean and seasonal quantiles are slow to compute.
+# Each statistic is computed once and saved to a small sidecar file next to the source (or in cache_dir), named after the source (so after area and period) and the statistic parameters.
+# The size and modification time of the source are saved in the sidecar, which is recomputed when they change
+# ==========================
+
+def source_stamp(source):
+    """returns the (size, modification time in ns) of file source, used to check that a sidecar file is still valid. For a folder (zarr store), the total size and latest modification time of its files"""
+    if os.path.isdir(source):
+        stats = [os.stat(os.path.join(folder,name)) for folder, subfolders, names in os.walk(source) for name in names]
+        return sum(stat.st_size for stat in stats), max((stat.st_mtime_ns for stat in stats),default=0)
+    stat = os.stat(source)
+    return stat.st_size, stat.st_mtime_ns
+
+def sidecar_path(source,name,cache_dir=None):
+    """returns the path of the sidecar file of statistic name computed from file source, in cache_dir (default: folder of source)"""
+    if cache_dir is None:
+        cache_dir = os.path.dirname(source)
+    return os.path.join(cache_dir,os.path.splitext(os.path.basename(os.path.normpath(source)))[0] + f"_{name}.nc")
+
+def cached(source,name,compute,cache_dir=None):
+    """Returns the statistic name of file source from its sidecar file if it is still valid, otherwise computes and saves it.
+        :param source: netcdf file (or zarr store) the statistic is computed from
+        :param name: name of the statistic, with its parameters (part of the sidecar file name)
+        :param compute: function computing the statistic (a DataArray) from the source file path
+        :param cache_dir: optional. folder of the sidecar files, default the folder of source
+        returns the loaded DataArray (without the attributes identifying the source)"""
+    path = sidecar_path(source,name,cache_dir)
+    size, mtime = source_stamp(source)
+    if os.path.exists(path):
+        with xr.open_dataarray(path) as da:
+            valid = da.attrs.get("source_size") == size and da.attrs.get("source_mtime_ns") == mtime
+            if valid:
+                da = da.load()
+        if valid:
+            da.attrs = {}
+            return da
+    print(f"computing {name} of {source}")
+    da = compute(source).load()
+    da.attrs = dict(source=os.path.basename(source),source_size=size,source_mtime_ns=mtime)
+    ut.atomic_write(path,da.to_netcdf)
+    da.attrs = {}
+    return da
+
+def dayofyear_mean(source,var="TREFHTMX",window=20,cache_dir=None):
+    """returns the day of year mean of var in source, smoothed with a centered running mean of window days and averaged over members (cached)"""
+    def compute(source):
+        with xr.open_dataset(source) as clim:
+            return clim[var].groupby("time.dayofyear").mean().rolling(dayofyear=window,center=True).mean().mean("member")
+    return cached(source,f"{var}_dayofyear_mean_window{window}",compute,cache_dir)
+
+def season_quantile(source,q=0.9,season="JJA",var="TREFHTMX",cache_dir=None):
+    """returns the quantile q of all values of var in season in source (cached)"""
+    def compute(source):
+        with xr.open_dataset(source) as clim:
+            return clim[var].groupby("time.season")[season].quantile(q)
+    return cached(source,f"{var}_{season}_q{q}",compute,cache_dir)
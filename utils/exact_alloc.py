@@ -0,0 +1,196 @@
+import alloc as ac
+import bootstrap_alloc as ba
+import xarray as xr
+import numpy as np
+from tqdm import tqdm
+from numpy.random import default_rng
+rng = default_rng()
+
+# === Exact evaluation of an allocation from the empirical score distributions ===
+# A round draws counts[l] distinct members of lead l (like lead_ID_sample), from all members (replace=True) or from the members not drawn before (replace=False).
+# The maximum of the round is then below x with probability prod_l C(m_l(x),k_l)/C(n_l,k_l) (hypergeometric), with n_l the members in the pool and m_l(x) those with a score <= x (or no score).
+# Rounds drawn with replacement between them are independent (their CDFs multiply), rounds without replacement add up to one draw of the summed counts.
+# ==========================
+
+def _log_factorials(n):
+    """returns log(i!) for i = 0..n"""
+    return np.concatenate([[0.],np.cumsum(np.log(np.arange(1,n+1)))])
+
+def max_cdf(values,counts,available=None):
+    """Exact distribution of the maximum score of one round that draws counts[l] distinct members of each lead code l.
+        :param values: dense (lead_ID, member) array of scores (NaN for members without a score)
+        :param counts: number of members drawn per lead code (capped at the pool size, like lead_ID_sample)
+        :param available: optional. boolean (lead_ID, member) mask of the members that can be drawn. If None, all members
+        returns [sorted unique scores x, P(max <= x) for each x, P(no score drawn)]"""
+    values = np.asarray(values,dtype=float)
+    if available is None:
+        available = np.ones(values.shape,dtype=bool)
+    n_pool = available.sum(axis=-1)
+    k = np.minimum(np.asarray(counts),n_pool)
+    leads = np.flatnonzero(k > 0)
+    pool = np.where(available,values,np.nan)[leads]
+    n, k = n_pool[leads], k[leads]
+    log_fact = _log_factorials(values.shape[1])
+    def log_ratio(m,lead):
+        """log C(m,k)/C(n,k) of each lead, -inf where m < k"""
+        mk = np.maximum(m-k[lead],0)
+        ratio = log_fact[m] - log_fact[mk] - log_fact[n[lead]] + log_fact[n[lead]-k[lead]]
+        return np.where(m >= k[lead],ratio,-np.inf)
+    # below any score: only the members without a score
+    n_scoreless = n - np.sum(~np.isnan(pool),axis=-1)
+    start = log_ratio(n_scoreless,np.arange(len(leads)))
+    base_zero = np.sum(np.isinf(start))
+    base_log = np.sum(start[~np.isinf(start)])
+    p_none = np.exp(base_log) if base_zero == 0 else 0.
+    # going up through the sorted scores, each one raises m of its own lead by one
+    lead_idx, mem_idx = np.nonzero(~np.isnan(pool))
+    x = pool[lead_idx,mem_idx]
+    order = np.argsort(x,kind="stable")
+    x, lead_idx = x[order], lead_idx[order]
+    by_lead = np.argsort(lead_idx,kind="stable")
+    group_start = np.searchsorted(lead_idx[by_lead],lead_idx[by_lead])
+    rank = np.empty(len(x),dtype=int)
+    rank[by_lead] = np.arange(len(x)) - group_start
+    before = log_ratio(n_scoreless[lead_idx] + rank,lead_idx)
+    after = log_ratio(n_scoreless[lead_idx] + rank + 1,lead_idx)
+    zeros = base_zero + np.cumsum(np.isinf(after).astype(int) - np.isinf(before).astype(int))
+    logs = base_log + np.cumsum(np.where(np.isinf(after),0.,after) - np.where(np.isinf(before),0.,before))
+    cdf = np.clip(np.where(zeros == 0,np.exp(logs),0.),0.,1.)
+    # ties: the CDF at a score is the one after all events with that score
+    last = np.r_[x[1:] != x[:-1],True] if len(x) > 0 else np.empty(0,dtype=bool)
+    return x[last], cdf[last], p_none
+
+def cdf_at(x,cdf,p_none,points):
+    """evaluates a step CDF (from max_cdf) at points"""
+    if len(x) == 0:
+        # no score can be drawn (e.g. the leads allocated are used up or have no scores)
+        return np.full(np.shape(points),p_none,dtype=float)
+    idx = np.searchsorted(x,points,side="right") - 1
+    return np.where(idx >= 0,cdf[np.maximum(idx,0)],p_none)
+
+def combine_cdfs(cdfs):
+    """returns the CDF [x, P(max <= x), P(no score)] of the maximum of independent rounds, from a list of their CDFs"""
+    x = np.unique(np.concatenate([c[0] for c in cdfs]))
+    cdf = np.prod([cdf_at(*c,x) for c in cdfs],axis=0) if len(cdfs) > 0 else np.ones(len(x))
+    return x, cdf, np.prod([c[2] for c in cdfs])
+
+def expected_max(x,cdf,p_none,best=-np.inf):
+    """Expected value of max(best, M), with M distributed as the CDF [x, cdf, p_none].
+        :param best: optional. best score already found before (e.g. in earlier rounds). If -inf, the expected maximum given that any score is drawn
+        returns the expected maximum (best, or NaN without best, if no score can be drawn)"""
+    if len(x) == 0:
+        return best if np.isfinite(best) else np.nan
+    pmf = np.diff(np.r_[p_none,cdf])
+    if np.isfinite(best):
+        above = x > best
+        return best*cdf_at(x,cdf,p_none,best) + np.sum(x[above]*pmf[above])
+    if p_none >= 1:
+        return np.nan
+    return np.sum(x*pmf) / (1 - p_none)
+
+def exceedance(x,cdf,p_none,thresholds,best=-np.inf):
+    """returns the probability that max(best, M) is above each threshold, with M distributed as the CDF [x, cdf, p_none]"""
+    thresholds = np.asarray(thresholds,dtype=float)
+    return np.where(best > thresholds,1.,1 - cdf_at(x,cdf,p_none,thresholds))
+
+def expected_count(values,counts,thresholds,available=None):
+    """returns the expected number of drawn scores above each threshold, when drawing counts[l] distinct members of each lead code l (hypergeometric mean)"""
+    values = np.asarray(values,dtype=float)
+    if available is None:
+        available = np.ones(values.shape,dtype=bool)
+    n_pool = available.sum(axis=-1)
+    k = np.minimum(np.asarray(counts),n_pool)
+    above = np.sum(available[...,None] & (values[...,None] > np.asarray(thresholds,dtype=float)),axis=1)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        return np.sum(np.where(n_pool[:,None] > 0,k[:,None]*above/n_pool[:,None],0.),axis=0)
+
+def alloc_counts(alloc,lead_list):
+    """returns the array of counts per lead code of an allocation given as dict {lead_ID: count} (like find_alloc) or as array"""
+    if isinstance(alloc,dict):
+        index = {lead_ID: i for i,lead_ID in enumerate(lead_list)}
+        counts = np.zeros(len(lead_list),dtype=int)
+        for lead_ID, count in alloc.items():
+            counts[index[f"{lead_ID}"]] += count
+        return counts
+    return np.asarray(alloc,dtype=int)
+
+def evaluate_alloc(ds,allocs,replace=False,thresholds=None):
+    """Exactly evaluates the maximum score (and exceedances) of drawing a fixed allocation, without simulation.
+        :param ds: DataArray of boosted events with dimensions (lead_ID, member)
+        :param allocs: allocation (dict {lead_ID: count} like find_alloc, or array per lead_ID) or list of allocations of successive rounds
+        :param replace: whether members can be drawn again in later rounds (rounds independent) or not (rounds add up to one draw)
+        :param thresholds: optional. thresholds to give exceedance probabilities and expected exceedance counts for
+        returns dataset with expected_max (given any score is drawn), p_no_score, and if thresholds are given exceedance (probability the maximum is above) and expected_count (expected number of scores above)"""
+    values = ds.transpose("lead_ID","member").values
+    lead_list = [f"{ld}" for ld in ds.lead_ID.values]
+    if not isinstance(allocs,list):
+        allocs = [allocs]
+    counts = [alloc_counts(alloc,lead_list) for alloc in allocs]
+    if replace == True:
+        dist = combine_cdfs([max_cdf(values,c) for c in counts])
+    else:
+        dist = max_cdf(values,np.sum(counts,axis=0))
+    result = xr.Dataset({"expected_max": expected_max(*dist), "p_no_score": dist[2]})
+    if thresholds is not None:
+        result["exceedance"] = ("threshold", exceedance(*dist,thresholds))
+        if replace == True:
+            result["expected_count"] = ("threshold", np.sum([expected_count(values,c,thresholds) for c in counts],axis=0))
+        else:
+            result["expected_count"] = ("threshold", expected_count(values,np.sum(counts,axis=0),thresholds))
+        result = result.assign_coords(threshold=list(thresholds))
+    return result
+
+def score_hybrid(ds,n_top,n_batch,n_batch_start,len_loop,bootstrap,replace=False,rng=rng,thresholds=None,alloc_types=("Static","Weighted")):
+    """Evaluates the multi-round algorithm by simulating the screening and all rounds but the last (where the allocation depends on what was drawn), and computing the last round exactly given the simulated state.
+        Averaging over replicates gives the same expectations as score_algo, with less Monte Carlo noise (the randomness of the last round is integrated out).
+        :param ds: DataArray of boosted events with dimensions (lead_ID, member)
+        :param n_top: values of n_top (length of top events to use for allocation)
+        :param n_batch: value of n_batch (batch size for each allocation round)
+        :param n_batch_start: value of n_batch_start (batch size for screening round)
+        :param len_loop: how many rounds of allocation to perform (at least 1)
+        :param bootstrap: how many replicates of the simulated rounds
+        :param replace: whether or not to replace event when randomly sampled
+        :param rng: optional. numpy random generator to draw from
+        :param thresholds: optional. thresholds to give exceedance probabilities for
+        :param alloc_types: optional. allocation types to evaluate (any of "Static", "Weighted" and "Random")
+        returns dataset over (alloc_type, bootstrap) of the expected maximum score over all rounds given the simulated ones (expected_max), and of the exceedance probabilities (with thresholds)"""
+    values = ds.transpose("lead_ID","member").values.astype(float)
+    n_leads = values.shape[0]
+    lead_weights = ac.scored_members(values)
+    best = np.full((len(alloc_types),bootstrap),np.nan)
+    exp_max = np.full((len(alloc_types),bootstrap),np.nan)
+    exceed = None if thresholds is None else np.full((len(alloc_types),bootstrap,len(thresholds)),np.nan)
+    for bt in tqdm(range(bootstrap)):
+        (sampled, available_screening), lead_alloc_screening = ba.screening(values,n_batch_start,replace=replace,rng=rng)
+        top_screening = ac.merge_top(np.empty(0),np.empty(0,dtype=int),*sampled,n_top)
+        for a, alloc in enumerate(alloc_types):
+            top, top_codes = top_screening
+            available = available_screening.copy()
+            found = sampled[0]
+            lead_alloc = ac.find_alloc_array(alloc,top,top_codes,n_top,n_batch,n_leads,weights=lead_weights,rng=rng)
+            # simulated rounds
+            for i in range(len_loop - 1):
+                if replace == True:
+                    new_sampled = ba.lead_ID_sample_replace(values,lead_alloc,rng=rng)
+                else:
+                    new_sampled = ba.lead_ID_sample(values,lead_alloc,available,rng=rng)
+                top, top_codes = ac.merge_top(top,top_codes,*new_sampled,n_top)
+                found = np.concatenate([found,new_sampled[0]])
+                lead_alloc = ac.find_alloc_array(alloc,top,top_codes,n_top,n_batch,n_leads,weights=lead_weights,rng=rng)
+            # exact last round
+            dist = max_cdf(values,lead_alloc,available=None if replace == True else available)
+            best[a,bt] = found.max() if len(found) > 0 else -np.inf
+            exp_max[a,bt] = expected_max(*dist,best=best[a,bt])
+            if thresholds is not None:
+                exceed[a,bt] = exceedance(*dist,thresholds,best=best[a,bt])
+    result = xr.Dataset(
+        {
+            "expected_max": (["alloc_type","bootstrap"], exp_max),
+            "simulated_max": (["alloc_type","bootstrap"], best),
+        },
+        coords={"alloc_type": list(alloc_types)},
+    )
+    if thresholds is not None:
+        result["exceedance"] = (["alloc_type","bootstrap","threshold"], exceed)
+        result = result.assign_coords(threshold=list(thresholds))
+    return result
@@ -0,0 +1,63 @@
+import os
+import re
+import json
+import fnmatch
+import utils as ut
+
+# === Index of boosted run files ===
+# Boosted runs are stored as {boost}B*cmip6.{parent member}.{start date}.ens{member}/atm/hist/B*cmip6.*.*.ens{member}.cam.h1.*-00000.nc
+# Instead of a recursive glob per case and day, the boost folder is scanned once and the files are indexed by (start date, parent member) -> [(member, file)].
+# The index is saved as json and reused until the boost folder changes (or rebuild=True)
+# ==========================
+
+RUN_DIR = re.compile(r"^B.*cmip6\.(000.*)\.(\d{4}-\d{2}-\d{2})\.ens.*$") # parent member and start date of a boosted run folder
+RUN_FILE = re.compile(r"^B.*cmip6\..*\..*\.ens(\d+)\.cam\.h1\..*-00000\.nc$") # member of a boosted run file
+
+def scan_boost(boost):
+    """Scans the boosted runs folder once. Files with "old" in their path are left out.
+        :param boost: folder of the boosted runs (ending with /)
+        returns dict of {start date: {parent member: [[member, path relative to boost], ...]}}"""
+    runs = {}
+    with os.scandir(boost) as entries:
+        for entry in entries:
+            match = RUN_DIR.match(entry.name)
+            if match is None or "old" in entry.name or not entry.is_dir():
+                continue
+            parent, date = match.groups()
+            hist = os.path.join(entry.name,"atm","hist")
+            try:
+                files = os.listdir(os.path.join(boost,hist))
+            except FileNotFoundError:
+                continue
+            for fi in files:
+                match_file = RUN_FILE.match(fi)
+                if match_file is None or "old" in fi:
+                    continue
+                runs.setdefault(date,{}).setdefault(parent,[]).append([int(match_file.group(1)),os.path.join(hist,fi)])
+    return runs
+
+def boost_index(boost,cache_file,rebuild=False):
+    """Returns the index of boosted run files, from the json cache_file if it is still valid (same boost folder, not modified since), otherwise by scanning boost and saving it to cache_file
+        :param boost: folder of the boosted runs (ending with /)
+        :param cache_file: json file to save the index in
+        :param rebuild: optional. whether to scan again even if the cache is valid (e.g. after new files were added in an existing run folder)
+        returns the index dict"""
+    mtime = os.stat(boost).st_mtime_ns
+    if not rebuild and os.path.exists(cache_file):
+        with open(cache_file,"r") as f:
+            index = json.load(f)
+        if index["boost"] == boost and index["mtime"] == mtime:
+            return index
+    print(f"scanning {boost}")
+    index = {"boost": boost, "mtime": mtime, "runs": scan_boost(boost)}
+    ut.write_json(index,cache_file)
+    return index
+
+def boost_files(index,mem,date):
+    """returns the sorted list of (member, file) of the boosted runs started on date from parent member mem (parent folder name matching 000*{mem}, like the original glob)"""
+    runs = index["runs"].get(str(date),{})
+    files = []
+    for parent in runs:
+        if fnmatch.fnmatchcase(parent,f"000*{mem}"):
+            files += [(member, index["boost"]+path) for member, path in runs[parent]]
+    return sorted(files,key=lambda member_file: member_file[1])
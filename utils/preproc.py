@@ -2,41 +2,105 @@ import xarray as xr
 import numpy as np
 import dask.config
 import glob
+import os
+import hashlib
 import csv
+import threading
 import datetime as dt
 from tqdm import tqdm
 import regionmask
 
-from utils import read_area, to_000, read_regionmask, to_dt,read_boost
+from utils import read_area, to_000, read_regionmask, to_dt,read_boost,atomic_write
+import file_index as fi
+import zarr_store as zs
 
-def preprocess(ds,read_type,area="global",var="TREFHTMX"):
-    """returns a dataset ds with a variable var, either as a linear mean over an area, or as global map """
-    ds_out = xr.Dataset()
-    if area == "global":
-        ds_out[var] = ds[var]
-        return ds_out
+_area_weights = {} # normalized weights already computed, per (area, read_type, area definition, grid)
+_area_weights_lock = threading.Lock() # weights are computed and written by one thread at a time (dask may preprocess files on several)
+
+def grid_key(ds):
+    """returns a short hash of the lat and lon of ds, identifying its grid"""
+    return hashlib.sha1(np.asarray(ds.lat.values).tobytes() + np.asarray(ds.lon.values).tobytes()).hexdigest()[:12]
+
+def area_key(area,read_type):
+    """returns a short hash of the definition of area in inputs/areas (box bounds or regionmask country), so weights are recomputed when it changes"""
+    definition = read_area(area) if read_type == "box" else read_regionmask(area)
+    return hashlib.sha1(f"{read_type}:{definition}".encode()).hexdigest()[:12]
+
+def area_weights(ds,read_type,area,cache_dir=None):
+    """returns the (lat, lon) weights of area on the grid of ds: cos(lat) inside the area (box or regionmask), 0 outside, normalized to a sum of 1.
+    They are computed once per area definition and grid, then kept in memory and, if cache_dir is given, in a file there"""
+    key = (area,read_type,area_key(area,read_type),grid_key(ds))
+    with _area_weights_lock:
+        if key not in _area_weights:
+            _area_weights[key] = _compute_area_weights(ds,read_type,area,key,cache_dir)
+        return _area_weights[key]
+
+def _compute_area_weights(ds,read_type,area,key,cache_dir=None):
+    """computes the weights of area_weights, or reads them from their cache file in cache_dir"""
+    path = None if cache_dir is None else cache_dir + f"weights_{area}_{read_type}_{key[2]}_{key[3]}.nc"
+    if path is not None and os.path.exists(path):
+        wgt = xr.open_dataarray(path).load()
     else:
         if read_type == "box":
             [min_lat,max_lat,min_lon,max_lon] = read_area(area)
-            ds = ds.sel(lat=slice(min_lat,max_lat),lon=slice(min_lon,max_lon))
+            inside = (ds.lat >= min_lat) & (ds.lat <= max_lat) & (ds.lon >= min_lon) & (ds.lon <= max_lon)
         elif read_type == "regionmask":
             country = read_regionmask(area)
-            mask = regionmask.defined_regions.natural_earth_v5_0_0.countries_110.mask(ds.lon,ds.lat)
-            ds = ds.where(mask == country,drop=True)
+            inside = regionmask.defined_regions.natural_earth_v5_0_0.countries_110.mask(ds.lon,ds.lat) == country
+        wgt = (np.cos(np.deg2rad(ds.lat)) * inside).transpose("lat","lon").astype(float)
+        wgt = (wgt / wgt.sum()).rename("weights").reset_coords(drop=True)
+        if path is not None:
+            atomic_write(path,wgt.to_netcdf)
+    return wgt
+
+def area_weights_multi(ds,read_types,cache_dir=None):
+    """returns a dict of {area: weights} (see area_weights) on the grid of ds for the areas of read_types (dict of {area: read_type}), without global"""
+    return {area: area_weights(ds,read_type,area,cache_dir=cache_dir) for area, read_type in read_types.items() if area != "global"}
+
+def preprocess(ds,read_type,area="global",var="TREFHTMX",cache_dir=None,wgt=None):
+    """returns a dataset ds with a variable var, either as a linear mean over an area (cos(lat) weighted, see area_weights, or the weights wgt if given) skipping missing values, or as global map """
+    ds_out = xr.Dataset()
+    if area == "global":
+        ds_out[var] = ds[var]
+        return ds_out
+    else:
         if var in ds.data_vars:
-            da = ds[var]
-            wgt = np.cos(np.deg2rad(ds.lat))
-            ds_out[var] = da.weighted(wgt).mean(("lat","lon"))
+            if wgt is None:
+                wgt = area_weights(ds,read_type,area,cache_dir=cache_dir)
+            # weighted sum of the valid values over their total weight (NaN where the area has none), as da.weighted(wgt).mean
+            total = xr.dot(ds[var].fillna(0.),wgt,dim=["lat","lon"])
+            norm = xr.dot(ds[var].notnull(),wgt,dim=["lat","lon"])
+            ds_out[var] = total / norm.where(norm > 0)
         else:
             print(f"Error, {var} not in data vars")
         return ds_out
 
-def preproc_unpert(in_path, output_path,area,read_type):
+def preprocess_multi(ds,read_types,var="TREFHTMX",cache_dir=None,weights=None):
+    """returns a dataset with one variable {var}_{area} per area, each reduced as in preprocess, so a file read once serves all areas
+        :param read_types: dict of {area: read_type}
+        :param weights: optional. dict of {area: weights} already computed (see area_weights_multi)"""
+    weights = {} if weights is None else weights
+    ds_out = xr.Dataset()
+    for area in read_types:
+        ds_out[f"{var}_{area}"] = preprocess(ds,read_types[area],area=area,var=var,cache_dir=cache_dir,wgt=weights.get(area))[var]
+    return ds_out
+
+def split_areas(ds,areas,var="TREFHTMX"):
+    """returns a list with the dataset of each area (with variable var) from a dataset made by preprocess_multi"""
+    return [ds[[f"{var}_{area}"]].rename({f"{var}_{area}":var}) for area in areas]
+
+def preproc_unpert(in_path, output_path,area,read_type,store_format="netcdf"):
     """preprocesses all micro ensemble members (2005-2035) for a specified area for TREFHTMX. Saves the output in location specified by output_path"""
+    return preproc_unpert_multi(in_path,output_path,{area:read_type},store_format=store_format)
+
+def preproc_unpert_multi(in_path,output_path,read_types,store_format="netcdf"):
+    """preprocesses all micro ensemble members (2005-2035) for several areas at once for TREFHTMX, reading each file only once. Saves the output of each area in location specified by output_path
+        :param read_types: dict of {area: read_type}
+        :param store_format: optional. "netcdf" (one .nc file per area) or "zarr" (one store per area chunked along time, see zarr_store)"""
     dss = []
-    #define preproc for that area
+    #define preproc for those areas
     def prep(ds):
-        return preprocess(ds,read_type,area=area)
+        return preprocess_multi(ds,read_types,cache_dir=output_path)
     for mem in tqdm(range(1,31)): #TODO: what about extra members 31-35?
         file = sorted(glob.glob(in_path+f"b.e212.B*cmip6.f09_g17.001.2005.ens{to_000(str(mem))}/archive/atm/hist/b.e212.B*cmip6.f09_g17.001.2005.ens{to_000(str(mem))}.cam.h1.*-01-01-00000.nc"))
         with xr.open_mfdataset(file,preprocess = prep) as ds:
@@ -46,50 +110,105 @@ def preproc_unpert(in_path, output_path,area,read_type):
     ds["member"] = range(1,31)
     ds = ds.set_coords('member')
     print("processed")
-    ds.to_netcdf(output_path+f"TREFHTMX_{area}_2005-2035.nc")
+    # all areas are written in one computation, so the files are read once
+    if store_format == "zarr":
+        zs.write_many(split_areas(ds,read_types),[output_path+f"TREFHTMX_{area}_2005-2035.zarr" for area in read_types],zs.TIME_CHUNKS)
+    else:
+        xr.save_mfdataset(split_areas(ds,read_types),[output_path+f"TREFHTMX_{area}_2005-2035.nc" for area in read_types])
     print("saved")
     return None
 
-def preproc_boost(boost, output_path,area,read_type):
-    """preprocesses all boosted cases (specified for each area in csv files in folder inputs), for a specified area for TREFHTMX. Saves the output in location specified by output_path"""
-    #define preproc for that area
-    def prep(ds):
-        return preprocess(ds,read_type,area=area)
-    area_boost = read_boost(area)
-    for case in area_boost:
-        print(case)
+def preproc_boost(boost, output_path,area,read_type,index=None,store_format="netcdf"):
+    """preprocesses all boosted cases (specified for each area in csv files in folder inputs), for a specified area for TREFHTMX. Saves the output in location specified by output_path.
+    Files are found through the index of boosted runs (see file_index.boost_index), which is loaded from (or saved to) output_path if not given"""
+    return preproc_boost_multi(boost,output_path,{area:read_type},index=index,store_format=store_format)
+
+def preproc_boost_multi(boost,output_path,read_types,index=None,store_format="netcdf"):
+    """preprocesses all boosted cases of several areas at once for TREFHTMX: a case boosted for several areas is read once and reduced to all of them. Saves the output of each area and case in location specified by output_path.
+    Files are found through the index of boosted runs (see file_index.boost_index), which is loaded from (or saved to) output_path if not given
+        :param read_types: dict of {area: read_type}
+        :param store_format: optional. "netcdf" (one .nc file per area and case) or "zarr" (one store per area with a group per case, see zarr_store). 
+        With "zarr", only the runs (start date, member) not in the store yet are read and added to their case (the case is rewritten if they have start dates or times it does not have)"""
+    if index is None:
+        index = fi.boost_index(boost,output_path+"boost_file_index.json")
+    # areas to preprocess each boosted case (and date range) for
+    cases = {}
+    for area in read_types:
+        area_boost = read_boost(area)
+        if area_boost is None:
+            print(f"no boosted cases for {area}")
+            continue
+        for case in area_boost:
+            cases.setdefault((case,area_boost[case][0],area_boost[case][1]),[]).append(area)
+    for (case,start_date,end_date), areas in cases.items():
+        print(case,areas)
+        #define preproc for the areas of that case
+        case_types = {area:read_types[area] for area in areas}
+        weights = {}
+        def prep(ds):
+            return preprocess_multi(ds,case_types,cache_dir=output_path,weights=weights)
         mem = case[0:-5]
-        date = area_boost[case][0]
-        end_date = area_boost[case][1]
         delta = dt.timedelta(days=1)
+        stores = [output_path+f"TREFHTMX_{area}_boosted.zarr" for area in areas]
+        # runs (start date, member) of the case already stored (in the stores of all its areas, read from a regional one if any)
+        stored = None
+        present = set()
+        if store_format == "zarr" and all(case in zs.groups(store) for store in stores):
+            regional = [store for area, store in zip(areas,stores) if area != "global"]
+            stored = zs.open_store((regional + stores)[0],group=case)
+            has_data = stored.TREFHTMX.notnull().any([dim for dim in stored.TREFHTMX.dims if dim not in ("start_date","member")]).load()
+            present = {(str(date), int(member)) for date, member in zip(*[has_data[dim].values[idx] for dim, idx in zip(has_data.dims,np.nonzero(has_data.values))])}
         
-        #file naming conventions
-        if int(case[3:]) < 2015:
-            fi_len = [77,80] 
-        else:
-            fi_len = [79,82] 
-        # open and preprocess for all lead times
-        dss = []
-        dates = []
-        while date <= end_date:
-            files = sorted(glob.glob(boost+f"B*cmip6.000*{mem}.{date}.ens*/atm/hist/B*cmip6.*.*.ens*.cam.h1.*-00000.nc"))
-            f = [fi for fi in files if "old" not in fi]
-            print(date,len(f))
-            if f != []:
-                dates.append(str(date))
-                with xr.open_mfdataset(f, preprocess=prep,concat_dim="member", combine="nested",parallel=True) as ds:
-                    print("opened")
-                    print([(fi[fi_len[0]:fi_len[1]]) for fi in f])
-                    ds["member"] = [int(fi[fi_len[0]:fi_len[1]]) for fi in f]
-                    ds = ds.set_coords('member')
-                    print("processed")
-                    dss.append(ds)
-            date += delta
-        # gathering all lead times into one file
-        ds=xr.concat(dss,dim="start_date")
-        ds["start_date"] = dates
-        ds = ds.set_coords('start_date')
+        def read_case(skip):
+            """opens and preprocesses the runs of the case for all lead times, except the (start date, member) in skip. returns the dataset, None if there are no runs"""
+            dss = []
+            dates = []
+            date = start_date
+            while date <= end_date:
+                files = [(member, fi_path) for member, fi_path in fi.boost_files(index,mem,date) if (str(date), member) not in skip]
+                f = [fi_path for member, fi_path in files]
+                print(date,len(f))
+                if f != []:
+                    dates.append(str(date))
+                    if weights == {}:
+                        # the files are preprocessed on several threads: the weights are computed (or read from their cache file) once before, from the first file
+                        with xr.open_dataset(f[0]) as first:
+                            weights.update(area_weights_multi(first,case_types,cache_dir=output_path))
+                    with xr.open_mfdataset(f, preprocess=prep,concat_dim="member", combine="nested",parallel=True) as ds:
+                        print("opened")
+                        print([member for member, fi_path in files])
+                        ds["member"] = [member for member, fi_path in files]
+                        ds = ds.set_coords('member')
+                        print("processed")
+                        dss.append(ds)
+                date += delta
+            if dss == []:
+                return None
+            # gathering all lead times
+            ds=xr.concat(dss,dim="start_date")
+            ds["start_date"] = dates
+            return ds.set_coords('start_date')
+        
+        ds = read_case(present)
+        if ds is None:
+            print("no new runs")
+            continue
+        update = False
+        if stored is not None:
+            if set(ds.start_date.values) <= set(stored.start_date.values) and set(ds.time.values) <= set(stored.time.values):
+                # new runs on the start dates and times of the stored ones are added to the stores
+                update = True
+            else:
+                print("new start dates or times: rewriting the case")
+                ds = read_case(set())
         print("processed")
-        ds.to_netcdf(output_path+f"TREFHTMX_{area}_boosted_{case}.nc")
+        # one file (or store group) per area
+        if store_format == "zarr" and update:
+            for ds_area, store in zip(split_areas(ds,areas),stores):
+                zs.update(ds_area,store,zs.TIME_CHUNKS,group=case)
+        elif store_format == "zarr":
+            zs.write_many(split_areas(ds,areas),stores,zs.TIME_CHUNKS,groups=[case]*len(areas))
+        else:
+            xr.save_mfdataset(split_areas(ds,areas),[output_path+f"TREFHTMX_{area}_boosted_{case}.nc" for area in areas])
         print("saved")
     return None
\ No newline at end of file
@@ -0,0 +1,157 @@
+import json
+import os
+import warnings
+import numpy as np
+import xarray as xr
+import utils as ut
+
+# === Checkpoint store of a parameter sweep ===
+# A sweep writes each finished (n_batch_start, n_batch, n_top) grid cell to its own .nc file in a store folder.
+# manifest.json in that folder holds the seed and configuration of the sweep and the list of finished cells, so a restarted sweep only runs the missing cells
+# ==========================
+
+def cell_name(cell):
+    """returns the file name of grid cell (n_batch_start, n_batch, n_top)"""
+    n_batch_start, n_batch, n_top = cell
+    return f"cell_start{n_batch_start}_batch{n_batch}_top{n_top}.nc"
+
+def open_manifest(store,config,seed=None):
+    """Opens the manifest of a sweep store, or creates the store if it does not exist yet.
+        :param store: folder of the sweep store
+        :param config: dict of sweep settings that have to be the same when restarting (e.g. len_loop, bootstrap)
+        :param seed: optional. seed of the sweep. If None, the seed of an existing store is used, or fresh entropy for a new one
+        returns the manifest dict"""
+    path = os.path.join(store,"manifest.json")
+    if isinstance(seed,np.random.SeedSequence):
+        seed = seed.entropy
+    if os.path.exists(path):
+        with open(path,"r") as f:
+            manifest = json.load(f)
+        if manifest["config"] != config:
+            raise ValueError(f"sweep store {store} was made with {manifest['config']}, not {config}. remove it or choose another save_info")
+        if seed is not None and str(seed) != manifest["seed"]:
+            raise ValueError(f"sweep store {store} was made with seed {manifest['seed']}, not {seed}")
+        return manifest
+    os.makedirs(store,exist_ok=True)
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    manifest = {"seed": str(seed), "config": config, "done": []}
+    ut.write_json(manifest,path,indent=1)
+    return manifest
+
+def is_done(store,manifest,cell):
+    """returns whether grid cell is finished (listed in the manifest and its file exists)"""
+    return list(cell) in manifest["done"] and os.path.exists(os.path.join(store,cell_name(cell)))
+
+def write_cell(store,cell,score_info):
+    """writes the result of one grid cell to the store (not yet marked as done)"""
+    path = os.path.join(store,cell_name(cell))
+    ut.atomic_write(path,lambda tmp: score_info.to_netcdf(tmp,format="NETCDF4"))
+
+def mark_done(store,manifest,cell):
+    """adds a written grid cell to the manifest"""
+    if list(cell) not in manifest["done"]:
+        manifest["done"].append(list(cell))
+    ut.write_json(manifest,os.path.join(store,"manifest.json"),indent=1)
+
+def timing_path(store,cell):
+    """returns the path of the phase timings of grid cell (see timing)"""
+    return os.path.join(store,cell_name(cell)[:-3] + "_timing.json")
+
+def open_timings(store,cells):
+    """returns a dict of {cell file name: phase timings} of the grid cells that have timings saved"""
+    timings = {}
+    for cell in cells:
+        path = timing_path(store,cell)
+        if os.path.exists(path):
+            with open(path,"r") as f:
+                timings[cell_name(cell)[:-3]] = json.load(f)
+    return timings
+
+def open_cells(store,cells):
+    """lazily opens (with dask) the files of grid cells. returns a dict of {cell: dataset}"""
+    return {tuple(cell): xr.open_dataset(os.path.join(store,cell_name(cell)),chunks={}) for cell in cells}
+
+
+# === Compact encodings of score_info ===
+# "dense": as built by score_algo, scores NaN padded over distribution_value
+# "ragged": non-NaN scores of all (bootstrap, alloc_type, round) stored one after the other over dimension event, with their offset and count, and integer chosen_leads
+# dimensions before bootstrap (e.g. case, see bootstrap_alloc.score_algo_batched) are kept in front of all variables
+# "summary": only the maximum, quantiles, number of scores and exceedance counts over thresholds of each round, and integer chosen_leads
+# ==========================
+
+def encode_score_info(score_info,encoding="dense",quantiles=(0.5,0.9,0.99),thresholds=None):
+    """Encodes the score_info dataset of one grid cell (as built by score_algo or score_algo_batched).
+        :param score_info: dataset with variables chosen_leads and score (scores of a round first, then NaN padding)
+        :param encoding: "dense" (unchanged), "ragged" or "summary"
+        :param quantiles: optional. quantiles of the scores of each round kept in the summary
+        :param thresholds: optional. list of thresholds, the summary counts the scores of each round above each of them
+        returns the encoded dataset"""
+    if encoding == "dense":
+        return score_info
+    cell_dims = [dim for dim in score_info.score.dims if dim not in ("bootstrap","alloc_type","round","distribution_value")] + ["bootstrap","alloc_type","round"]
+    scores = score_info.score.transpose(*cell_dims,"distribution_value").values
+    count = np.sum(~np.isnan(scores),axis=-1)
+    chosen_leads = score_info.chosen_leads.transpose(*cell_dims,"lead_ID").values
+    encoded = xr.Dataset(
+        {
+            # integer, unless NaN for the lead_IDs a case does not have (stored as integers with fill value once gathered, see count_encoding)
+            "chosen_leads": (cell_dims+["lead_ID"], chosen_leads if np.isnan(chosen_leads).any() else chosen_leads.astype(np.int32)),
+            "score_count": (cell_dims, count.astype(np.int32)),
+        },
+        coords={co: score_info[co] for co in cell_dims[:-3]+["alloc_type","round","lead_ID"]},
+        attrs=dict(score_info.attrs,encoding=encoding),
+    )
+    if encoding == "ragged":
+        encoded["score_offset"] = (cell_dims, (np.cumsum(count) - count.ravel()).reshape(count.shape))
+        encoded["score_value"] = ("event", scores[np.arange(scores.shape[-1]) < count[...,None]])
+        # indexed, so cells with different numbers of events can be concatenated
+        encoded = encoded.assign_coords(event=range(encoded.sizes["event"]))
+    elif encoding == "summary":
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore",category=RuntimeWarning) # rounds without any score
+            encoded["score_max"] = (cell_dims, np.nanmax(scores,axis=-1))
+            encoded["score_quantile"] = (cell_dims+["quantile"], np.moveaxis(np.nanquantile(scores,quantiles,axis=-1),0,-1))
+        encoded = encoded.assign_coords(quantile=list(quantiles))
+        if thresholds is not None and len(thresholds) > 0:
+            encoded["exceedance"] = (cell_dims+["threshold"], np.sum(scores[...,None] > np.asarray(thresholds),axis=-2).astype(np.int32))
+            encoded = encoded.assign_coords(threshold=list(thresholds))
+    else:
+        raise ValueError(f"encoding should be 'dense', 'ragged' or 'summary', not {encoding}")
+    return encoded
+
+def count_encoding(score_info):
+    """returns the netcdf encoding that stores the integer variables of a gathered ragged or summary score_info (float with NaN for missing cells) as integers, with fill value -1"""
+    if score_info.attrs.get("encoding","dense") == "dense":
+        return {}
+    counts = ["chosen_leads","score_count","score_offset","exceedance"]
+    return {var: {"dtype": "int64" if var == "score_offset" else "int32", "_FillValue": -1} for var in counts if var in score_info}
+
+def decode_score_info(encoded):
+    """Decodes a ragged score_info dataset (one grid cell, or a full sweep gathered over start_batch_size, batch_size and top_length) back to the dense layout. Dense datasets are returned unchanged"""
+    encoding = encoded.attrs.get("encoding","dense")
+    if encoding == "dense":
+        return encoded
+    elif encoding != "ragged":
+        raise ValueError(f"a {encoding} score_info can not be decoded to dense scores")
+    # cells missing from a sweep grid are NaN after gathering
+    count = encoded.score_count.fillna(0).astype(int)
+    offset = encoded.score_offset.fillna(0).astype(int)
+    grid = [dim for dim in encoded.score_value.dims if dim != "event"]
+    cell_dims = grid + [dim for dim in encoded.score_count.dims if dim not in grid]
+    count = count.transpose(*cell_dims).values
+    offset = offset.transpose(*cell_dims).values
+    values = encoded.score_value.transpose(*grid,"event").values
+    # one extra NaN at the end of the values, for the padding
+    values = np.concatenate([values,np.full(values.shape[:-1]+(1,),np.nan)],axis=-1)
+    to_pad = count.max(initial=0)
+    index = np.minimum(offset[...,None] + np.arange(to_pad),values.shape[-1]-1)
+    flat_index = index.reshape(index.shape[:len(grid)] + (-1,))
+    scores = np.take_along_axis(values,flat_index,axis=-1).reshape(index.shape)
+    scores = np.where(np.arange(to_pad) < count[...,None],scores,np.nan)
+    decoded = encoded.drop_vars(["score_value","score_offset","score_count"]).drop_dims("event")
+    decoded["chosen_leads"] = decoded.chosen_leads.astype(float)
+    decoded["score"] = (cell_dims + ["distribution_value"], scores)
+    decoded = decoded.assign_coords(distribution_value=range(to_pad))
+    decoded.attrs["encoding"] = "dense"
+    return decoded
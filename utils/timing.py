@@ -0,0 +1,100 @@
+import json
+import time
+import contextlib
+import numpy as np
+import xarray as xr
+
+# === Opt-in timing of the phases of the allocation algorithm ===
+# Code to time is wrapped in "with phase(name,items):". Off by default: phase then returns a shared do-nothing context, so the cost is one function call.
+# items that cost something to count (e.g. a sum in an inner loop) are given as a function, only called when timing is on
+# When enabled, each phase records its number of calls, wall time (inclusive of nested phases, e.g. screening includes its sampling) and number of items processed.
+# Stats are per process: a sweep worker records each grid cell in its own recording() context and saves them next to the cell (see bootstrap_alloc._score_cell)
+# ==========================
+
+_enabled = False
+_stats = {} # {phase name: [calls, seconds, items]}
+_off = contextlib.nullcontext()
+
+class _Phase:
+    """context that adds its wall time, one call and items to the stats of phase name"""
+    __slots__ = ("name","items","start")
+    def __init__(self,name,items):
+        self.name = name
+        self.items = items
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self,*exc):
+        stat = _stats.setdefault(self.name,[0,0.,0])
+        stat[0] += 1
+        stat[1] += time.perf_counter() - self.start
+        stat[2] += int(self.items)
+        return False
+
+def enable(on=True):
+    """turns the timing on (or off with on=False)"""
+    global _enabled
+    _enabled = on
+
+def is_enabled():
+    """returns whether the timing is on"""
+    return _enabled
+
+def reset():
+    """forgets all recorded stats"""
+    _stats.clear()
+
+@contextlib.contextmanager
+def recording():
+    """context that turns the timing on with empty stats, and restores the previous state and stats on exit (so a caller's own timing is left untouched). 
+    Read the stats of the wrapped code with stats() inside the context"""
+    global _enabled
+    prev_enabled, prev_stats = _enabled, {name: list(stat) for name, stat in _stats.items()}
+    _enabled = True
+    _stats.clear()
+    try:
+        yield
+    finally:
+        _enabled = prev_enabled
+        _stats.clear()
+        _stats.update(prev_stats)
+
+def phase(name,items=0):
+    """returns a context that times the code it wraps as phase name, processing items (e.g. events drawn, replicates allocated, or a function returning them). does nothing when timing is off"""
+    if not _enabled:
+        return _off
+    return _Phase(name,items() if callable(items) else items)
+
+def stats():
+    """returns the recorded stats as a dict of {phase name: {"calls", "seconds", "items"}}"""
+    return {name: {"calls": calls, "seconds": seconds, "items": items} for name, (calls, seconds, items) in _stats.items()}
+
+def total(all_stats):
+    """sums a list of stats dicts (e.g. of all grid cells of a sweep) into one"""
+    summed = {}
+    for st in all_stats:
+        for name, stat in st.items():
+            summed_stat = summed.setdefault(name,{"calls": 0, "seconds": 0., "items": 0})
+            for key in summed_stat:
+                summed_stat[key] += stat[key]
+    return summed
+
+def to_dataset(cell_stats):
+    """converts a dict of {cell name: stats dict} into a dataset of calls, seconds and items over dimensions (cell, phase), 0 where a phase did not run"""
+    cells = list(cell_stats)
+    phases = list(dict.fromkeys(name for st in cell_stats.values() for name in st))
+    ds = xr.Dataset(coords={"cell": cells, "phase": phases})
+    for key, dtype in [("calls",int),("seconds",float),("items",int)]:
+        values = np.array([[cell_stats[cell].get(name,{key: 0})[key] for name in phases] for cell in cells],dtype=dtype).reshape(len(cells),len(phases))
+        ds[key] = (["cell","phase"], values)
+    return ds
+
+def save_json(content,path):
+    """saves stats (or a dict of stats) as json"""
+    with open(path,"w") as f:
+        json.dump(content,f,indent=1)
+
+def load_json(path):
+    """loads stats saved with save_json"""
+    with open(path,"r") as f:
+        return json.load(f)
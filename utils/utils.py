@@ -1,5 +1,8 @@
 import glob
 import csv
+import json
+import os
+import threading
 import datetime as dt
 import xarray as xr
 
@@ -54,8 +57,9 @@ def to_cel(da):
 def to_dt(string):
     return dt.datetime(int(string[0:4]),int(string[5:7]),int(string[8:]))
 
-def concat_to_ds(list,dim,typ_name):
-    ds = xr.concat(list,dim=dim)
+def concat_to_ds(list,dim,typ_name,**kwargs):
+    """concatenates list along the new dimension dim, labeled typ_name. kwargs are passed on to xr.concat (e.g. join)"""
+    ds = xr.concat(list,dim=dim,**kwargs)
     ds[dim] = typ_name
     return ds
 
@@ -66,4 +70,25 @@ def multi_to_single_index(ds,dims=("case","lead_time"),new_name="lead_ID"):
     stacked["event"] = coords
     stacked = stacked.drop_vars(dims)
     stacked = stacked.rename({"event":new_name})
-    return stacked
\ No newline at end of file
+    return stacked
+
+def atomic_write(path,write):
+    """Writes the file path through a temporary file next to it, moved onto path once complete, so an interrupted write never leaves a broken file. 
+    The temporary name is unique per process and thread, so concurrent writers of the same file don't clash (the last one wins).
+        :param write: function writing the content to the path it is given (e.g. ds.to_netcdf)
+        returns path"""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp,path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+def write_json(content,path,indent=None):
+    """writes content to the json file path (see atomic_write). returns path"""
+    def dump(tmp):
+        with open(tmp,"w") as f:
+            json.dump(content,f,indent=indent)
+    return atomic_write(path,dump)
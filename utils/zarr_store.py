@@ -0,0 +1,88 @@
+import os
+import pandas as pd
+import xarray as xr
+
+# === Chunked zarr stores of the preprocessed time series and scores ===
+# Optional alternative to the netcdf files passed between the preprocessing steps (store_format "zarr" in the scripts):
+#   time series: TREFHTMX_{area}_2005-2035.zarr, chunked along time
+#   boosted time series: TREFHTMX_{area}_boosted.zarr, one group per case (cases have their own start dates, members and times), chunked along time
+#   scores: boosted_{area}_{score}_lead_ID_{with_lead_ID}_roll{roll}.zarr, chunked along (lead_ID, member)
+# A new case is written as a new group and new members are appended along member (or merged into the members already stored, see update), without rewriting what is already stored.
+# The metadata of a store is consolidated after each write, so it opens with a single read. zarr is only imported when a zarr store is used
+# ==========================
+
+ZARR_FORMAT = 2 # consolidated metadata and string coordinates (e.g. lead_ID) are part of the version 2 specification
+TIME_CHUNKS = {"time": 365, "member": 1} # chunks of time series (dimensions not given are one chunk)
+SCORE_CHUNKS = {"lead_ID": 256, "lead_time": 256, "member": 100} # chunks of scores
+
+def _zarr():
+    """returns the zarr module, with a clear message if it is not installed"""
+    try:
+        import zarr
+    except ImportError as err:
+        raise ImportError("store_format 'zarr' needs the zarr package (see environment.yml)") from err
+    return zarr
+
+def groups(path):
+    """returns the sorted names of the groups (e.g. cases) of the zarr store path, empty if it does not exist"""
+    if not os.path.exists(path):
+        return []
+    return sorted(_zarr().open_group(path,mode="r").group_keys())
+
+def _chunked(ds,chunks):
+    """returns ds chunked by chunks ({dim: size}, for the dims ds has), without the encodings of the files it was read from (their chunks would conflict)"""
+    return ds.drop_encoding().chunk({dim: min(size,ds.sizes[dim]) for dim, size in chunks.items() if dim in ds.dims})
+
+def consolidate(path):
+    """consolidates the metadata of all groups of the zarr store path into one file"""
+    _zarr().consolidate_metadata(path)
+
+def write(ds,path,chunks,group=None):
+    """Writes ds to the zarr store path (or to its group), replacing what it held.
+        :param chunks: dict of chunk size per dimension (e.g. TIME_CHUNKS or SCORE_CHUNKS)
+        :param group: optional. group to write to (e.g. the case), other groups are kept
+        returns path"""
+    return write_many([ds],[path],chunks,groups=[group])[0]
+
+def write_many(datasets,paths,chunks,groups=None):
+    """Writes each dataset to its zarr store (like write) in one computation, so data they share (e.g. the files of all areas) is read once, like xr.save_mfdataset. returns paths"""
+    import dask
+    _zarr()
+    if groups is None:
+        groups = [None]*len(paths)
+    writes = [_chunked(ds,chunks).to_zarr(path,group=group,mode="w",consolidated=False,compute=False,zarr_format=ZARR_FORMAT) for ds, path, group in zip(datasets,paths,groups)]
+    dask.compute(*writes)
+    for path in dict.fromkeys(paths):
+        consolidate(path)
+    return paths
+
+def update(ds,path,chunks,group=None,dim="member"):
+    """Adds ds to the zarr store path (or to its group) without rewriting it: values of dim not stored yet are appended, values already stored are merged into their slot (the stored data is kept where ds is NaN).
+    The other dimensions of ds have to be within the stored ones (ds is reindexed to them). If the store (group) does not exist yet, ds is written
+        :param chunks: dict of chunk size per dimension (e.g. TIME_CHUNKS or SCORE_CHUNKS)
+        returns path"""
+    zarr = _zarr()
+    if not os.path.exists(path) or (group is not None and group not in zarr.open_group(path,mode="r").group_keys()):
+        return write(ds,path,chunks,group=group)
+    stored = open_store(path,group=group)
+    ds = ds.reindex({d: stored[d].values for d in ds.dims if d != dim})
+    position = pd.Index(stored[dim].values).get_indexer(ds[dim].values)
+    # values already stored: each slot is read, merged and written back in place
+    for i, value in zip(position[position >= 0],ds[dim].values[position >= 0]):
+        merged = ds.sel({dim: [value]}).combine_first(stored.isel({dim: [i]})).load()
+        merged = merged.drop_vars([var for var in merged.variables if dim not in merged[var].dims]).drop_encoding()
+        merged.to_zarr(path,group=group,region={dim: slice(i,i+1)},consolidated=False,zarr_format=ZARR_FORMAT)
+    new = ds[dim].values[position < 0]
+    if len(new) > 0:
+        _chunked(ds.sel({dim: new}),chunks).to_zarr(path,group=group,append_dim=dim,consolidated=False,zarr_format=ZARR_FORMAT)
+    consolidate(path)
+    return path
+
+def open_store(path,group=None):
+    """lazily opens (with dask) the zarr store path (or its group)"""
+    _zarr()
+    return xr.open_zarr(path,group=group)
+
+def open_cases(path):
+    """lazily opens all case groups of a boosted time series store. returns a dict of {case: dataset}"""
+    return {case: open_store(path,group=case) for case in groups(path)}